@@ -7,3 +7,11 @@ class ApiConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        """Подключает сигналы и замер SQL-запросов."""
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .timing import install_query_wrapper
+        connection_created.connect(install_query_wrapper)
@@ -0,0 +1,220 @@
+"""Асинхронные версии дешевых ручек для запуска под ASGI.
+
+Переключатели избранного, корзины и подписок, а также теги
+и ингредиенты работают через асинхронный ORM Django и не держат
+воркер, пока ждут БД. Ответы совпадают с синхронными view из
+api.views; какие из них подключать, решает настройка ASYNC_VIEWS.
+"""
+import functools
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+
+from . import routers, toggles
+from .authentication import CachedTokenAuthentication
+from .cache import TAGS_GENERATION, get_versioned
+from .ingredient_index import get_ingredient_index
+from .models import FavoriteRecipe, Recipe, ShoppingCart, Tag
+from .serializers import TagSerializer, UserSubscribedSerializer
+from .views import render_tags
+
+authentication = CachedTokenAuthentication()
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """Ответ в JSON, как его отрисовал бы JSONRenderer DRF."""
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        content_type='application/json')
+
+
+def error_response(exc):
+    """Ответ для исключения DRF в формате его обработчика ошибок."""
+    response = json_response({'detail': exc.detail}, exc.status_code)
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = authentication.authenticate_header(
+            None)
+    return response
+
+
+def async_api_view(methods, authenticate=True, login_required=False):
+    """Декоратор асинхронной view вместо api_view DRF.
+
+    Проверяет метод, аутентифицирует по токену и кладет пользователя
+    в request.user вместо ленивого пользователя сессии, который нельзя
+    загружать в event loop. Безопасные запросы читают с реплики, как
+    ReplicaReadMixin в api.views. Как и view DRF, освобождает ручку
+    от проверки CSRF.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                request.user, request.auth = AnonymousUser(), None
+                if authenticate:
+                    result = await authentication.aauthenticate(request)
+                    if result is not None:
+                        request.user, request.auth = result
+                if login_required and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+            except exceptions.APIException as exc:
+                return error_response(exc)
+            token = await routers.aroute_reads(request)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                routers.reset_reads(token)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def not_found():
+    """Ответ 404 с текстом NotFound DRF."""
+    return error_response(exceptions.NotFound())
+
+
+async def toggle_recipe(request, model, recipe_id, added, missing):
+    """Добавляет рецепт в список model пользователя или убирает из него.
+
+    Как и в api.views, одним запросом из api.toggles.
+    """
+    if request.method == 'POST':
+        recipe = await sync_to_async(toggles.add_recipe)(
+            model, request.user.id, recipe_id)
+        if recipe is None:
+            return not_found()
+        if not recipe.added:
+            return json_response({'detail': added},
+                                 status.HTTP_400_BAD_REQUEST)
+        return json_response({
+            'id': recipe.id,
+            'name': recipe.name,
+            'image': recipe.image.url if recipe.image else None,
+            'cooking_time': recipe.cooking_time
+        }, status.HTTP_201_CREATED)
+
+    removed = await sync_to_async(toggles.remove_recipe)(
+        model, request.user.id, recipe_id)
+    if removed is None:
+        return not_found()
+    if not removed:
+        return json_response({'detail': missing},
+                             status.HTTP_400_BAD_REQUEST)
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@async_api_view(['POST', 'DELETE'], login_required=True)
+async def favorite(request, id):
+    """Добавляет или удаляет рецепт из избранного."""
+    return await toggle_recipe(request, FavoriteRecipe, id,
+                               'Рецепт уже в избранном.',
+                               'Рецепт не найден в избранном.')
+
+
+@async_api_view(['POST', 'DELETE'], login_required=True)
+async def shopping_cart(request, id):
+    """Добавляет или удаляет рецепт из списка покупок."""
+    return await toggle_recipe(request, ShoppingCart, id,
+                               'Рецепт уже в списке покупок.',
+                               'Рецепт не найден в списке покупок.')
+
+
+@async_api_view(['POST', 'DELETE'], login_required=True)
+async def subscribe(request, id):
+    """Подписка или отписка от пользователя."""
+    if request.method == 'POST':
+        if id == request.user.id:
+            return json_response(
+                {'detail': 'Нельзя подписаться на самого себя.'},
+                status.HTTP_400_BAD_REQUEST)
+        author = await sync_to_async(toggles.subscribe)(request.user.id, id)
+        if author is None:
+            return not_found()
+        return json_response(await serialize_author(request, author),
+                             status.HTTP_201_CREATED)
+
+    subscribed = await sync_to_async(toggles.unsubscribe)(
+        request.user.id, id)
+    if subscribed is None:
+        return not_found()
+    if not subscribed:
+        return json_response({'detail': 'Не подписан.'},
+                             status.HTTP_400_BAD_REQUEST)
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+async def serialize_author(request, author):
+    """Автор с последними рецептами, как в UserSubscriptionViewSet."""
+    try:
+        limit = max(int(request.GET['recipes_limit']), 0)
+    except (KeyError, ValueError):
+        limit = None
+    recipes_by_author = defaultdict(list)
+    async for recipe in Recipe.objects.filter(
+            author=author).latest_per_author(limit):
+        recipes_by_author[recipe.author_id].append(recipe)
+    return UserSubscribedSerializer(author, context={
+        'request': request,
+        'recipes_by_author': recipes_by_author,
+        'image_variant': 'small',
+    }).data
+
+
+@async_api_view(['GET'], authenticate=False)
+async def tag_list(request):
+    """Список тегов из кеша с ETag, как TagViewSet.list."""
+    body, etag = await sync_to_async(get_versioned)(TAGS_GENERATION,
+                                                    render_tags)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@async_api_view(['GET'], authenticate=False)
+async def tag_detail(request, pk):
+    """Тег по pk."""
+    tag = None
+    if pk.isdigit():
+        tag = await Tag.objects.filter(pk=pk).afirst()
+    if tag is None:
+        return not_found()
+    return json_response(TagSerializer(tag).data)
+
+
+@async_api_view(['GET'])
+async def ingredient_list(request):
+    """Автодополнение ингредиентов, как IngredientViewSet.list."""
+    query = request.GET.get('name') or request.GET.get('search', '')
+    try:
+        limit = int(request.GET.get('limit',
+                                    settings.INGREDIENT_SEARCH_LIMIT))
+    except ValueError:
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+    limit = max(1, min(limit, settings.INGREDIENT_SEARCH_MAX_LIMIT))
+    index = await sync_to_async(get_ingredient_index)()
+    return json_response(index.search(query, limit))
+
+
+@async_api_view(['GET'])
+async def ingredient_detail(request, pk):
+    """Ингредиент из индекса по id."""
+    index = await sync_to_async(get_ingredient_index)()
+    try:
+        ingredient = index.get(int(pk))
+    except ValueError:
+        ingredient = None
+    if ingredient is None:
+        return json_response({'detail': 'Ингредиент не найден.'},
+                             status.HTTP_404_NOT_FOUND)
+    return json_response(ingredient)
@@ -0,0 +1,201 @@
+"""Аутентификация по токену с кешем пользователей."""
+import threading
+import time
+from collections import OrderedDict
+
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import (TokenAuthentication,
+                                           get_authorization_header)
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+from .cache import bump_generation, get_generation
+
+FIELDS = tuple(User._meta.concrete_fields)
+FIELD_NAMES = tuple(field.attname for field in FIELDS)
+ID_POSITION = FIELD_NAMES.index('id')
+
+
+class TokenCache:
+    """Потокобезопасный LRU: ключ токена -> (поколение, снимок полей).
+
+    Поколение — номер отзыва токенов пользователя на момент чтения
+    из БД (revocation). Записи живут не дольше ttl секунд, при
+    переполнении вытесняются самые давно использованные.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """Пустой кеш на maxsize записей."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(поколение, снимок) по ключу токена или None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Запоминает (поколение, снимок)."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Удаляет запись по ключу токена."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_user(self, user_id):
+        """Удаляет все записи пользователя."""
+        with self._lock:
+            for key in [key for key, (_, (_, snapshot)) in self._data.items()
+                        if snapshot[ID_POSITION] == user_id]:
+                del self._data[key]
+
+    def clear(self):
+        """Очищает кеш."""
+        with self._lock:
+            self._data.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def _shared_key(key):
+    """Ключ снимка в общем кеше."""
+    return f'authtoken:{key}'
+
+
+def _shared_user_key(user_id):
+    """Ключ токена пользователя в общем кеше."""
+    return f'authtoken:user:{user_id}'
+
+
+def revocation(user_id):
+    """Имя поколения отзыва токенов пользователя в api.cache."""
+    return f'authtoken:{user_id}'
+
+
+def revoke(user_id):
+    """Отзывает токены пользователя во всех процессах после коммита.
+
+    LRU других процессов сверяют с этим поколением каждое попадание.
+    Сдвиг после коммита не дает им перечитать из БД еще не удаленный
+    токен под новым поколением.
+    """
+    transaction.on_commit(partial(bump_generation, revocation(user_id)))
+
+
+def evict_token(key, user_id):
+    """Забывает токен, например при выходе."""
+    if settings.TOKEN_CACHE_SHARED:
+        transaction.on_commit(partial(cache.delete, _shared_key(key)))
+    else:
+        token_cache.delete(key)
+    revoke(user_id)
+
+
+def _evict_shared_user(user_id):
+    """Удаляет снимок пользователя из общего кеша."""
+    key = cache.get(_shared_user_key(user_id))
+    if key is not None:
+        cache.delete_many([_shared_key(key), _shared_user_key(user_id)])
+
+
+def evict_user(user_id):
+    """Забывает токены пользователя после изменения или удаления."""
+    if settings.TOKEN_CACHE_SHARED:
+        transaction.on_commit(partial(_evict_shared_user, user_id))
+    else:
+        token_cache.delete_user(user_id)
+    revoke(user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД для известных токенов.
+
+    Пользователь восстанавливается из снимка полей, который хранится
+    в LRU процесса, а при TOKEN_CACHE_SHARED — в общем кеше Django.
+    Записи сбрасываются сигналами при удалении токена и изменении или
+    удалении пользователя. Чтобы выход сразу был виден всем воркерам,
+    попадание в любой из кешей сверяется с поколением отзыва
+    пользователя в общем кеше: это одно чтение маленького ключа вместо
+    запроса к БД. Снимок, который конкурентный запрос успел положить
+    в общий кеш до коммита выхода, так отбрасывается сдвигом поколения.
+    """
+
+    def authenticate_credentials(self, key):
+        """Возвращает (user, token) для ключа токена."""
+        if settings.TOKEN_CACHE_SHARED:
+            item = cache.get(_shared_key(key))
+        else:
+            item = token_cache.get(key)
+        if item is not None:
+            generation, snapshot = item
+            if generation == get_generation(
+                    revocation(snapshot[ID_POSITION])):
+                return self.restore(key, snapshot)
+            if settings.TOKEN_CACHE_SHARED:
+                cache.delete(_shared_key(key))
+            else:
+                token_cache.delete(key)
+        user, token = super().authenticate_credentials(key)
+        self.remember(key, user)
+        return user, token
+
+    async def aauthenticate(self, request):
+        """Асинхронный authenticate для view без DRF.
+
+        Проверка токена, включая сверку поколения отзыва в общем кеше,
+        идет в потоке через sync_to_async.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        try:
+            key, = auth[1:]
+            key = key.decode()
+        except (ValueError, UnicodeError):
+            raise AuthenticationFailed('Invalid token header.')
+        return await sync_to_async(self.authenticate_credentials)(key)
+
+    def restore(self, key, snapshot):
+        """(user, token) из снимка полей пользователя."""
+        user = User.from_db('default', FIELD_NAMES, snapshot)
+        return user, Token(key=key, user=user)
+
+    def remember(self, key, user):
+        """Кладет снимок пользователя в кеш.
+
+        Снимок ложится с поколением отзыва, прочитанным после БД:
+        выход, закоммиченный между этими двумя чтениями, проживет
+        в кеше до TOKEN_CACHE_TTL или TOKEN_CACHE_SHARED_TTL.
+        """
+        snapshot = tuple(field.get_prep_value(field.value_from_object(user))
+                         for field in FIELDS)
+        item = (get_generation(revocation(user.pk)), snapshot)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.set_many({_shared_key(key): item,
+                            _shared_user_key(user.pk): key},
+                           settings.TOKEN_CACHE_SHARED_TTL)
+        else:
+            token_cache.set(key, item)
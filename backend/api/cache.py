@@ -0,0 +1,91 @@
+"""Счетчики поколений и отметки времени для инвалидации кешей."""
+import time
+
+from django.core.cache import cache
+
+from .routers import use_primary
+
+TAGS_GENERATION = 'tags'
+FEED_GENERATION = 'recipes'
+
+
+def _generation_key(name):
+    """Ключ счетчика поколения name в кеше."""
+    return f'generation:{name}'
+
+
+def _seed():
+    """Начальное значение вытесненного или нового счетчика поколения.
+
+    Отсчет с 1 повторил бы номера, под которыми в кеше еще могут лежать
+    старые значения, и они снова стали бы актуальными. Время
+    в наносекундах больше любого прежнего номера: счетчик растет
+    на единицу за изменение.
+    """
+    return time.time_ns()
+
+
+def get_generation(name):
+    """Возвращает текущее поколение данных name."""
+    return cache.get_or_set(_generation_key(name), _seed, None)
+
+
+def get_generations(*names):
+    """Текущие поколения names одним обращением к кешу."""
+    keys = [_generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    return [found[key] if key in found else get_generation(name)
+            for key, name in zip(keys, names)]
+
+
+def bump_generation(name):
+    """Сдвигает поколение name, делая устаревшими все зависимые кеши."""
+    key = _generation_key(name)
+    cache.add(key, _seed(), None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключ успели вытеснить между add() и incr().
+        generation = _seed()
+        cache.set(key, generation, None)
+        return generation
+
+
+def get_versioned(name, build, timeout=None):
+    """Возвращает значение build(), закешированное для поколения name.
+
+    После bump_generation(name) старое значение больше не читается
+    и вытесняется из кеша само. build() читает с primary.
+    """
+    key = f'{name}:{get_generation(name)}'
+    value = cache.get(key)
+    if value is None:
+        with use_primary():
+            value = build()
+        cache.set(key, value, timeout)
+    return value
+
+
+def _timestamp_key(name):
+    """Ключ отметки времени name в кеше."""
+    return f'timestamp:{name}'
+
+
+def get_timestamp(name):
+    """Время последнего изменения данных name.
+
+    Если отметки нет (еще не было изменений или ее вытеснили), она
+    ставится на текущий момент: лучше лишний раз отдать полный ответ,
+    чем ошибочный 304.
+    """
+    return cache.get_or_set(_timestamp_key(name), time.time, None)
+
+
+def touch_timestamp(name):
+    """Отмечает, что данные name изменились сейчас."""
+    cache.set(_timestamp_key(name), time.time(), None)
+
+
+def viewer_timestamp(user_id):
+    """Имя отметки времени избранного, корзины и подписок user_id."""
+    return f'viewer:{user_id}'
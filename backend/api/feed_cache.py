@@ -0,0 +1,100 @@
+"""Кеш ответов ленты рецептов для анонимных пользователей."""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import FEED_GENERATION, get_generation
+from .filters import RecipeFilter
+from .routers import use_primary
+
+CACHED_PARAMS = frozenset(RecipeFilter.base_filters) | {
+    'page', 'limit', 'cursor'}
+STATS_KEYS = {'hits': 'feed_cache:hits', 'misses': 'feed_cache:misses'}
+
+
+def feed_cache_key(request):
+    """Ключ кеша из хоста и нормализованных параметров ленты.
+
+    Посторонние параметры отбрасываются, а значения сортируются, так что
+    ?tags=a&tags=b и ?tags=b&tags=a попадают в одну запись.
+    """
+    params = sorted(
+        (name, sorted(request.query_params.getlist(name)))
+        for name in request.query_params if name in CACHED_PARAMS)
+    digest = hashlib.md5(
+        repr((request.get_host(), params)).encode()).hexdigest()
+    return f'feed:{get_generation(FEED_GENERATION)}:{digest}'
+
+
+def get_or_build(key, build):
+    """Возвращает (значение, попадание) из кеша или строит его.
+
+    Строит значение только тот запрос, который взял блокировку;
+    остальные промахи по тому же ключу ждут его результата, а не идут
+    в БД одновременно. Не дождавшийся запрос строит значение сам,
+    но чужую блокировку не снимает. build() читает с primary.
+    """
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value, True
+
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.FEED_CACHE_LOCK_TIMEOUT
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + lock_timeout
+    locked = cache.add(lock_key, token, lock_timeout)
+    while not locked and time.monotonic() <= deadline:
+        time.sleep(settings.FEED_CACHE_LOCK_POLL)
+        value = cache.get(key)
+        if value is not None:
+            _count('hits')
+            return value, True
+        locked = cache.add(lock_key, token, lock_timeout)
+    try:
+        with use_primary():
+            value = build()
+        cache.set(key, value, settings.FEED_CACHE_TIMEOUT)
+    finally:
+        if locked:
+            _release(lock_key, token)
+    _count('misses')
+    return value, False
+
+
+def _release(lock_key, token):
+    """Снимает блокировку, только если она все еще наша.
+
+    Если сборка шла дольше FEED_CACHE_LOCK_TIMEOUT, блокировка истекла
+    и ее мог взять другой запрос. Между get и delete она может истечь
+    снова, но это окно много меньше времени сборки.
+    """
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _count(name):
+    """Увеличивает счетчик попаданий или промахов."""
+    key = STATS_KEYS[name]
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_stats():
+    """Попадания, промахи и доля попаданий кеша ленты."""
+    hits = cache.get(STATS_KEYS['hits'], 0)
+    misses = cache.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses,
+            'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_stats():
+    """Обнуляет счетчики."""
+    cache.delete_many(list(STATS_KEYS.values()))
@@ -1,21 +1,21 @@
 """filters."""
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
-from .models import Recipe
+from .models import FavoriteRecipe, Recipe, ShoppingCart
 
 
 class RecipeFilter(filters.FilterSet):
     """Фильтр для рецептов."""
 
-    is_favorited = filters.BooleanFilter(field_name='is_favorited',
-                                         method='filter_is_favorited')
+    is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
-        field_name='is_in_shopping_cart',
         method='filter_is_in_shopping_cart')
     author = filters.NumberFilter(field_name='author')
-    tags = filters.CharFilter(field_name='tags__slug', lookup_expr='in')
+    tags = filters.CharFilter(method='filter_tags')
     date_from = filters.DateTimeFilter(field_name='data_time',
                                        lookup_expr='gte')
     date_to = filters.DateTimeFilter(field_name='data_time', lookup_expr='lte')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         """Мета."""
@@ -25,8 +25,39 @@ class RecipeFilter(filters.FilterSet):
 
     def filter_is_favorited(self, queryset, name, value):
         """Фильтрация по избранным рецептам."""
-        return queryset.filter(is_favorited=value)
+        return self.filter_user_recipes(queryset, FavoriteRecipe, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Фильтрация по рецептам в корзине."""
-        return queryset.filter(is_in_shopping_cart=value)
+        return self.filter_user_recipes(queryset, ShoppingCart, value)
+
+    def filter_user_recipes(self, queryset, model, value):
+        """Рецепты, которые есть (или нет) в model у текущего пользователя.
+
+        EXISTS по индексу (user, recipe) вместо JOIN со всей таблицей.
+        У анонима нет ни избранного, ни корзины.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        in_model = Exists(model.objects.filter(user=user,
+                                               recipe=OuterRef('pk')))
+        return queryset.filter(in_model if value else ~in_model)
+
+    def filter_tags(self, queryset, name, value):
+        """Фильтрация по слагам тегов: ?tags=lunch&tags=dinner.
+
+        EXISTS вместо JOIN не размножает рецепты с несколькими тегами
+        и не требует DISTINCT.
+        """
+        slugs = self.request.query_params.getlist('tags')
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=slugs)))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам.
+
+        Результаты упорядочены по релевантности, а не по дате.
+        """
+        value = value.strip()
+        return queryset.search(value) if value else queryset
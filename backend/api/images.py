@@ -0,0 +1,103 @@
+"""Фоновая подготовка уменьшенных копий изображений рецептов."""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import FEED_GENERATION, bump_generation
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+VARIANTS_DIR = 'recipes/images/variants'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков обработки, создается лениво в каждом процессе."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.RECIPE_IMAGE_WORKERS,
+                    thread_name_prefix='recipe-images')
+    return _executor
+
+
+def schedule_image_variants(recipe, old_variants=None):
+    """Ставит в очередь нарезку копий после коммита транзакции.
+
+    При RECIPE_IMAGE_WORKERS = 0 копии строятся сразу после коммита
+    в текущем потоке.
+    """
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    old_variants = old_variants or {}
+
+    def submit():
+        if settings.RECIPE_IMAGE_WORKERS:
+            get_executor().submit(
+                run_in_worker, recipe_id, image_name, old_variants)
+        else:
+            build_image_variants(recipe_id, image_name, old_variants)
+
+    transaction.on_commit(submit)
+
+
+def run_in_worker(recipe_id, image_name, old_variants):
+    """Обертка для потока пула: свое соединение с БД и лог ошибок."""
+    close_old_connections()
+    try:
+        build_image_variants(recipe_id, image_name, old_variants)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def build_image_variants(recipe_id, image_name, old_variants):
+    """Строит копии всех размеров и записывает их пути в рецепт.
+
+    Оригинал читается из хранилища поля Recipe.image, копии пишутся
+    в default_storage: у них свои имена и свой срок жизни.
+    """
+    image_storage = Recipe._meta.get_field('image').storage
+    with image_storage.open(image_name) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original = original.convert('RGB')
+    stem = PurePosixPath(image_name).stem
+    variants = {}
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        image = ImageOps.fit(original, size, Image.LANCZOS)
+        variants[variant] = {}
+        for ext, pil_format in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, pil_format,
+                       quality=settings.RECIPE_IMAGE_QUALITY)
+            name = default_storage.save(
+                f'{VARIANTS_DIR}/{recipe_id}/{stem}_{variant}.{ext}',
+                ContentFile(buffer.getvalue()))
+            variants[variant][ext] = name
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=image_name
+    ).update(image_variants=variants, updated_at=timezone.now())
+    if updated:
+        bump_generation(FEED_GENERATION)
+    else:
+        # Рецепт удален или картинку успели заменить.
+        old_variants = variants
+    for names in old_variants.values():
+        for name in names.values():
+            default_storage.delete(name)
@@ -0,0 +1,84 @@
+"""Префиксный индекс ингредиентов для автодополнения."""
+import threading
+from bisect import bisect_left
+
+from .cache import get_generation
+from .models import Ingredient
+from .routers import use_primary
+
+GENERATION = 'ingredients'
+
+_index = None
+_lock = threading.Lock()
+
+
+class IngredientIndex:
+    """Неизменяемый отсортированный индекс ингредиентов.
+
+    Строится один раз на процесс и пересобирается, когда поколение
+    'ingredients' сдвигается сигналами модели Ingredient.
+    """
+
+    __slots__ = ('generation', '_keys', '_rows', '_by_id')
+
+    def __init__(self, rows, generation):
+        """Сортирует строки (id, name, measurement_unit) по имени."""
+        rows = sorted(rows, key=lambda row: (row[1].casefold(), row[2]))
+        self.generation = generation
+        self._keys = tuple(row[1].casefold() for row in rows)
+        self._rows = tuple(rows)
+        self._by_id = {row[0]: row for row in rows}
+
+    def __len__(self):
+        """Количество ингредиентов в индексе."""
+        return len(self._rows)
+
+    def get(self, pk):
+        """Возвращает ингредиент по id или None."""
+        row = self._by_id.get(pk)
+        return _as_dict(row) if row else None
+
+    def search(self, query, limit):
+        """Ищет ингредиенты по началу названия, затем по подстроке.
+
+        Совпадения по префиксу находятся бинарным поиском и идут первыми,
+        остаток лимита добирается совпадениями по подстроке.
+        """
+        query = query.strip().casefold()
+        if not query:
+            return [_as_dict(row) for row in self._rows[:limit]]
+
+        result = []
+        position = bisect_left(self._keys, query)
+        while (position < len(self._keys) and len(result) < limit
+               and self._keys[position].startswith(query)):
+            result.append(self._rows[position])
+            position += 1
+
+        if len(result) < limit:
+            for key, row in zip(self._keys, self._rows):
+                if query in key and not key.startswith(query):
+                    result.append(row)
+                    if len(result) == limit:
+                        break
+        return [_as_dict(row) for row in result]
+
+
+def _as_dict(row):
+    """Строка индекса в формате IngredientSerializer."""
+    return {'id': row[0], 'name': row[1], 'measurement_unit': row[2]}
+
+
+def get_ingredient_index():
+    """Возвращает актуальный индекс, пересобирая его по primary."""
+    global _index
+    generation = get_generation(GENERATION)
+    index = _index
+    if index is not None and index.generation == generation:
+        return index
+    with _lock, use_primary():
+        if _index is None or _index.generation != generation:
+            rows = Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit')
+            _index = IngredientIndex(list(rows), generation)
+        return _index
@@ -0,0 +1 @@
+"""Команды."""
@@ -0,0 +1,278 @@
+"""Замер задержки и числа SQL-запросов по всем ручкам api."""
+import base64
+import io
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import shortlinks
+from api.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import User
+
+Step = namedtuple('Step', 'name client method path data', defaults=[None])
+
+
+def percentile(values, share):
+    """Перцентиль share (0..1) по методу ближайшего ранга."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(share * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def git_revision():
+    """Текущий коммит или None вне git."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def image_data_uri():
+    """Небольшая png-картинка в base64 для создания рецептов."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (120, 160, 80)).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class Command(BaseCommand):
+    """Прогоняет запросы ко всем ручкам api через тестовый клиент.
+
+    Каждый сценарий выполняется один раз для прогрева и --iterations
+    раз для замера. В JSON пишутся p50, p95, среднее и максимум
+    в миллисекундах, число SQL-запросов и коды ответов. Пишущие ручки
+    замеряются парами (создать/удалить), чтобы данные не менялись между
+    прогонами. Вход, выход, смена пароля и аватара не замеряются: они
+    меняют учетные данные пользователя, от имени которого идут запросы.
+    """
+
+    help = 'Замеряет p50/p95 и число запросов по ручкам api.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--user',
+                            help='Username зрителя; по умолчанию '
+                                 'пользователь с самой большой корзиной.')
+        parser.add_argument('--only', nargs='*', default=(),
+                            help='Имена сценариев для замера.')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения.')
+
+    def handle(self, *args, **options):
+        """Выполняет сценарии и сохраняет результаты."""
+        logging.getLogger('api.timing').disabled = True
+        iterations = max(1, options['iterations'])
+
+        viewer = self.get_viewer(options['user'])
+        token, _ = Token.objects.get_or_create(user=viewer)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.counter = itertools.count()
+
+        samples = {}
+        scenarios = self.get_scenarios(viewer, client, APIClient())
+        # Тестовый клиент ходит с Host: testserver.
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for scenario in scenarios:
+                if options['only'] and not any(
+                        step.name in options['only'] for step in scenario):
+                    continue
+                for number in range(iterations + 1):
+                    self.run(scenario, samples if number else {})
+
+        results = {name: self.summarize(values)
+                   for name, values in samples.items()}
+        for name, result in results.items():
+            self.stdout.write(
+                '{name:<32} p50 {p50_ms:>8.1f} ms  p95 {p95_ms:>8.1f} ms  '
+                'sql {queries:>3}  {statuses}'.format(name=name, **result))
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'created': datetime.now(timezone.utc).isoformat(),
+                'iterations': iterations,
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'recipe_ingredients': RecipeIngredient.objects.count(),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты записаны в {options["output"]}.'))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_viewer(self, username):
+        """Пользователь, от имени которого идут запросы."""
+        if username:
+            viewer = User.objects.filter(username=username).first()
+        else:
+            viewer = User.objects.annotate(
+                cart_size=Count('shoppingcart')
+            ).order_by('-cart_size', 'id').first()
+        if viewer is None:
+            raise CommandError('Нет данных: запустите generate_dataset.')
+        return viewer
+
+    def get_scenarios(self, viewer, client, anon):
+        """Сценарии: списки шагов, выполняемых подряд."""
+        recipe = Recipe.objects.exclude(author=viewer).exclude(
+            favoriterecipe_related__user=viewer
+        ).exclude(shoppingcart_related__user=viewer).order_by('-id').first()
+        author = User.objects.exclude(id=viewer.id).exclude(
+            subscribers__user=viewer).order_by('id').first()
+        if recipe is None or author is None:
+            raise CommandError('Слишком мало данных для бенчмарка.')
+        ingredient = Ingredient.objects.order_by('id').first()
+        tag = Tag.objects.order_by('id').first()
+        tags = list(Tag.objects.values_list('id', flat=True)[:2])
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:2])
+        pantry = list(RecipeIngredient.objects.values('ingredient').annotate(
+            uses=Count('id')).order_by('-uses').values_list(
+            'ingredient', flat=True)[:20])
+        ingredients = [{'id': pk, 'amount': 100} for pk in Ingredient.objects
+                       .order_by('id').values_list('id', flat=True)[:10]]
+        recipe_data = {'name': 'Бенчмарк', 'text': 'Описание',
+                       'cooking_time': 10, 'image': image_data_uri(),
+                       'tags': tags, 'ingredients': ingredients}
+
+        def new_user():
+            number = next(self.counter)
+            return {'email': f'bench_new_{number}@example.com',
+                    'username': f'bench_new_{number}', 'first_name': 'a',
+                    'last_name': 'b', 'password': 'Benchmark-123'}
+
+        def created_recipe(previous):
+            return f'/api/recipes/{previous.json()["id"]}/'
+
+        return [
+            [Step('user-list', client, 'get', '/api/users/?limit=6')],
+            [Step('user-list:cursor', client, 'get',
+                  '/api/users/?cursor=&limit=6')],
+            [Step('user-create', anon, 'post', '/api/users/', new_user)],
+            [Step('user-detail', client, 'get', f'/api/users/{author.id}/')],
+            [Step('users-me', client, 'get', '/api/users/me/')],
+            [Step('tag-list', anon, 'get', '/api/tags/')],
+            [Step('tag-detail', anon, 'get', f'/api/tags/{tag.id}/')],
+            [Step('ingredient-list', anon, 'get',
+                  f'/api/ingredients/?name={ingredient.name[:2]}')],
+            [Step('ingredient-detail', anon, 'get',
+                  f'/api/ingredients/{ingredient.id}/')],
+            [Step('recipe-list:anon', anon, 'get', '/api/recipes/')],
+            [Step('recipe-list', client, 'get', '/api/recipes/')],
+            [Step('recipe-list:page-100', client, 'get',
+                  '/api/recipes/?page=100')],
+            [Step('recipe-list:cursor', client, 'get',
+                  '/api/recipes/?cursor=')],
+            [Step('recipe-list:tags', client, 'get',
+                  '/api/recipes/?' + '&'.join(f'tags={slug}'
+                                              for slug in slugs))],
+            [Step('recipe-list:cart', client, 'get',
+                  '/api/recipes/?is_in_shopping_cart=1')],
+            [Step('recipe-list:search', client, 'get',
+                  '/api/recipes/?search=суп')],
+            [Step('recipe-detail', client, 'get',
+                  f'/api/recipes/{recipe.id}/')],
+            [Step('recipe-create', client, 'post', '/api/recipes/',
+                  recipe_data),
+             Step('recipe-update', client, 'patch', created_recipe,
+                  {**recipe_data, 'ingredients': ingredients[:5]}),
+             Step('recipe-delete', client, 'delete', created_recipe)],
+            [Step('recipe-get-link', client, 'get',
+                  f'/api/recipes/{recipe.id}/get-link/')],
+            [Step('short-link-redirect', anon, 'get',
+                  f'/s/{shortlinks.encode(recipe.id)}/')],
+            [Step('recipe-pantry', client, 'get',
+                  '/api/recipes/pantry/?missing=10&'
+                  + '&'.join(f'ingredients={pk}' for pk in pantry))],
+            [Step('favorite:post', client, 'post',
+                  f'/api/recipes/{recipe.id}/favorite/'),
+             Step('favorite:delete', client, 'delete',
+                  f'/api/recipes/{recipe.id}/favorite/')],
+            [Step('shopping-cart:post', client, 'post',
+                  f'/api/recipes/{recipe.id}/shopping_cart/'),
+             Step('shopping-cart:delete', client, 'delete',
+                  f'/api/recipes/{recipe.id}/shopping_cart/')],
+            [Step('download-shopping-cart', client, 'get',
+                  '/api/recipes/download_shopping_cart/')],
+            [Step('user-subscriptions', client, 'get',
+                  '/api/users/subscriptions/')],
+            [Step('user-subscribe:post', client, 'post',
+                  f'/api/users/{author.id}/subscribe/'),
+             Step('user-subscribe:delete', client, 'delete',
+                  f'/api/users/{author.id}/subscribe/')],
+        ]
+
+    def run(self, scenario, samples):
+        """Выполняет шаги сценария, складывая замеры в samples."""
+        previous = None
+        for step in scenario:
+            path = step.path(previous) if callable(step.path) else step.path
+            data = step.data() if callable(step.data) else step.data
+            request = getattr(step.client, step.method)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = request(path, data, format='json')
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                duration = time.perf_counter() - start
+            samples.setdefault(step.name, []).append(
+                (duration, len(queries), response.status_code))
+            previous = response
+        if any(step.name == 'user-create' for step in scenario):
+            User.objects.filter(username__startswith='bench_new_').delete()
+
+    def summarize(self, values):
+        """Статистика по замерам одного шага."""
+        durations = [duration * 1000 for duration, _, _ in values]
+        queries = sorted(count for _, count, _ in values)
+        statuses = sorted({status for _, _, status in values})
+        return {
+            'p50_ms': round(percentile(durations, 0.5), 2),
+            'p95_ms': round(percentile(durations, 0.95), 2),
+            'mean_ms': round(sum(durations) / len(durations), 2),
+            'max_ms': round(max(durations), 2),
+            'queries': queries[len(queries) // 2],
+            'max_queries': queries[-1],
+            'statuses': statuses,
+        }
+
+    def compare(self, path, results):
+        """Печатает изменения относительно прошлого прогона."""
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            change = ((result['p50_ms'] - before['p50_ms'])
+                      / before['p50_ms'] * 100 if before['p50_ms'] else 0)
+            self.stdout.write(
+                f'{name:<32} p50 {before["p50_ms"]:>8.1f} -> '
+                f'{result["p50_ms"]:>8.1f} ms ({change:+.0f}%)  '
+                f'sql {before["queries"]} -> {result["queries"]}')
@@ -0,0 +1,58 @@
+"""Соединения с PostgreSQL относительно max_connections."""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    """Показывает, сколько соединений открыто и сколько воркеров влезет.
+
+    Соединения берутся из pg_stat_activity и группируются по
+    application_name: в режиме pool каждый процесс подписывает свои
+    соединения как foodgram:<pid>. Ожидание соединения из пула
+    и заполненность пула по запросам пишутся в Server-Timing и строку
+    лога api.timing (поля pool_*).
+    """
+
+    help = 'Показывает соединения с БД и запас до max_connections.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Потоков на воркер без пула, например '
+                                 'gunicorn --threads.')
+
+    def handle(self, *args, **options):
+        """Печатает соединения и оценку числа воркеров."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT current_setting('max_connections')::int, "
+                "current_setting('superuser_reserved_connections')::int")
+            max_connections, reserved = cursor.fetchone()
+            cursor.execute(
+                'SELECT application_name, state, count(*) '
+                'FROM pg_stat_activity WHERE datname = current_database() '
+                'GROUP BY 1, 2 ORDER BY 1, 2')
+            rows = cursor.fetchall()
+
+        total = 0
+        for application, state, count in rows:
+            total += count
+            self.stdout.write(
+                f'{application or "-":<32} {state or "-":<20} {count:>5}')
+        available = max_connections - reserved
+        self.stdout.write(
+            f'Открыто соединений: {total} из {available} '
+            f'(max_connections {max_connections}, '
+            f'резерв {reserved}).')
+
+        mode = settings.DB_POOL_MODE
+        if mode == 'pool':
+            pool = settings.DATABASES['default']['OPTIONS']['pool']
+            per_worker = pool['max_size']
+        else:
+            per_worker = options['threads']
+        self.stdout.write(
+            f'Режим {mode}: до {per_worker} соединений на воркер, '
+            f'не больше {available // per_worker} воркеров на все '
+            f'серверы приложения.')
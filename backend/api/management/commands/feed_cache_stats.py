@@ -0,0 +1,24 @@
+"""Статистика кеша ленты рецептов."""
+from django.core.management.base import BaseCommand
+
+from api.feed_cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    """Печатает долю попаданий кеша анонимной ленты."""
+
+    help = 'Показывает попадания и промахи кеша ленты рецептов.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счетчики после вывода.')
+
+    def handle(self, *args, **options):
+        """Печатает статистику."""
+        stats = get_stats()
+        self.stdout.write(
+            'Попаданий: {hits}, промахов: {misses}, '
+            'доля попаданий: {hit_ratio:.1%}.'.format(**stats))
+        if options['reset']:
+            reset_stats()
@@ -0,0 +1,181 @@
+"""Генерация синтетических данных для бенчмарков."""
+import io
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from api.cache import FEED_GENERATION, bump_generation
+from api.ingredient_index import GENERATION as INGREDIENTS_GENERATION
+from api.models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
+                        ShoppingCart, Subscription, Tag)
+from api.pantry_index import GENERATION as PANTRY_GENERATION
+from users.models import User
+
+from .load_ingredients import chunked
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+BENCH_PASSWORD = 'benchmark'
+IMAGE_NAME = 'recipes/images/benchmark.jpg'
+TAGS = [('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'),
+        ('Десерт', 'dessert'), ('Суп', 'soup'), ('Салат', 'salad'),
+        ('Выпечка', 'bakery'), ('Гарнир', 'garnish'),
+        ('Веган', 'vegan'), ('Быстро', 'quick')]
+DISHES = ['суп', 'борщ', 'пирог', 'салат', 'каша', 'рагу', 'котлеты',
+          'плов', 'блины', 'омлет', 'запеканка', 'окрошка', 'паста',
+          'ризотто', 'жаркое', 'оладьи']
+
+
+def bench_username(seed, number):
+    """Имя синтетического пользователя."""
+    return f'bench{seed}_{number}'
+
+
+class Command(BaseCommand):
+    """Наполняет БД пользователями, рецептами и их связями.
+
+    Масштаб задается числом рецептов; пользователей в 20 раз меньше,
+    у каждого рецепта 5-20 ингредиентов из справочника и 1-3 тега.
+    Объекты создаются bulk_create без сигналов, поэтому в конце
+    сдвигаются поколения кешей.
+    """
+
+    help = 'Создает синтетический набор данных для бенчмарков.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--scale', choices=sorted(SCALES),
+                            default='10k')
+        parser.add_argument('--recipes', type=int,
+                            help='Число рецептов вместо --scale.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        """Создает данные и печатает их объем."""
+        recipes_count = options['recipes'] or SCALES[options['scale']]
+        self.chunk_size = max(1, options['chunk_size'])
+        self.random = random.Random(options['seed'])
+        seed = options['seed']
+        if User.objects.filter(username=bench_username(seed, 0)).exists():
+            raise CommandError(
+                f'Данные с --seed {seed} уже созданы, выберите другой.')
+
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = self.create_tags()
+        self.create_image()
+
+        users_count = max(10, recipes_count // 20)
+        user_ids = self.create_users(seed, users_count)
+        recipe_ids = self.create_recipes(user_ids, recipes_count)
+        self.create_recipe_ingredients(recipe_ids, ingredient_ids)
+        self.create_recipe_tags(recipe_ids, tag_ids)
+        self.create_user_recipes(FavoriteRecipe, user_ids, recipe_ids,
+                                 recipes_count)
+        self.create_user_recipes(ShoppingCart, user_ids, recipe_ids,
+                                 users_count * 3)
+        self.create_subscriptions(user_ids, users_count * 5)
+
+        for generation in (FEED_GENERATION, INGREDIENTS_GENERATION,
+                           PANTRY_GENERATION):
+            bump_generation(generation)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {users_count}, '
+            f'рецептов: {recipes_count}.'))
+
+    def create_tags(self):
+        """Создает недостающие теги и возвращает id всех тегов."""
+        existing = set(Tag.objects.values_list('slug', flat=True))
+        Tag.objects.bulk_create(Tag(name=name, slug=slug)
+                                for name, slug in TAGS
+                                if slug not in existing)
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_image(self):
+        """Кладет в хранилище общую для всех рецептов картинку."""
+        if default_storage.exists(IMAGE_NAME):
+            return
+        buffer = io.BytesIO()
+        Image.new('RGB', (960, 640), (200, 120, 60)).save(buffer, 'JPEG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+
+    def create_users(self, seed, count):
+        """Создает пользователей с одним общим хешем пароля."""
+        password = make_password(BENCH_PASSWORD)
+        users = (User(username=bench_username(seed, number),
+                      email=f'{bench_username(seed, number)}@example.com',
+                      first_name='Бенч', last_name=str(number),
+                      password=password)
+                 for number in range(count))
+        self.bulk_create(User, users)
+        return list(User.objects.filter(
+            username__startswith=f'bench{seed}_'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, user_ids, count):
+        """Создает рецепты у случайных авторов."""
+        rnd = self.random
+        recipes = (Recipe(author_id=rnd.choice(user_ids),
+                          name=f'{rnd.choice(DISHES).capitalize()} {number}',
+                          text=' '.join(rnd.choices(DISHES, k=12)),
+                          cooking_time=rnd.randint(5, 180),
+                          image=IMAGE_NAME)
+                   for number in range(count))
+        first_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        self.bulk_create(Recipe, recipes)
+        return list(Recipe.objects.filter(id__gt=first_id).order_by(
+            'id').values_list('id', flat=True))
+
+    def create_recipe_ingredients(self, recipe_ids, ingredient_ids):
+        """По 5-20 разных ингредиентов на рецепт."""
+        rnd = self.random
+        rows = (RecipeIngredient(recipe_id=recipe_id,
+                                 ingredient_id=ingredient_id,
+                                 amount=rnd.randint(1, 500))
+                for recipe_id in recipe_ids
+                for ingredient_id in rnd.sample(ingredient_ids,
+                                                rnd.randint(5, 20)))
+        self.bulk_create(RecipeIngredient, rows)
+
+    def create_recipe_tags(self, recipe_ids, tag_ids):
+        """По 1-3 тега на рецепт."""
+        through = Recipe.tags.through
+        rows = (through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.random.sample(tag_ids,
+                                                 self.random.randint(1, 3)))
+        self.bulk_create(through, rows)
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, count):
+        """Случайные пары (пользователь, рецепт) для избранного и корзины."""
+        rnd = self.random
+        rows = (model(user_id=rnd.choice(user_ids),
+                      recipe_id=rnd.choice(recipe_ids))
+                for _ in range(count))
+        self.bulk_create(model, rows, ignore_conflicts=True)
+
+    def create_subscriptions(self, user_ids, count):
+        """Случайные подписки, без подписок на себя."""
+        rnd = self.random
+        pairs = ((rnd.choice(user_ids), rnd.choice(user_ids))
+                 for _ in range(count))
+        rows = (Subscription(user_id=user_id, subscribed_to_id=author_id)
+                for user_id, author_id in pairs if user_id != author_id)
+        self.bulk_create(Subscription, rows, ignore_conflicts=True)
+
+    def bulk_create(self, model, objects, **kwargs):
+        """bulk_create пачками, каждая в своей транзакции."""
+        total = 0
+        for chunk in chunked(objects, self.chunk_size):
+            with transaction.atomic():
+                model.objects.bulk_create(chunk, **kwargs)
+            total += len(chunk)
+        self.stdout.write(f'{model._meta.label}: {total}')
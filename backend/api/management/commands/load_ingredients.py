@@ -0,0 +1,170 @@
+"""Загрузка справочника ингредиентов из csv или json."""
+import csv
+import io
+import itertools
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_generation
+from api.ingredient_index import GENERATION as INGREDIENTS_GENERATION
+from api.models import Ingredient
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data' / 'ingredients.csv'
+MAX_LENGTH = Ingredient._meta.get_field('name').max_length
+
+
+def read_csv(path):
+    """Построчно читает пары (name, measurement_unit) из csv."""
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            yield row[:2] if len(row) >= 2 else None
+
+
+def read_json(path):
+    """Читает пары из json-массива объектов."""
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    for item in data:
+        yield _from_mapping(item)
+
+
+def read_jsonl(path):
+    """Построчно читает пары из json lines."""
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield _from_mapping(json.loads(line))
+
+
+def _from_mapping(item):
+    """Пара (name, measurement_unit) из словаря или None."""
+    if not isinstance(item, dict):
+        return None
+    return [item.get('name'), item.get('measurement_unit')]
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_jsonl}
+
+
+def clean(rows, stats):
+    """Отбрасывает пустые, слишком длинные и повторяющиеся строки."""
+    seen = set()
+    for row in rows:
+        stats['total'] += 1
+        if row is None:
+            stats['skipped'] += 1
+            continue
+        name, unit = (str(value or '').strip() for value in row)
+        key = (name, unit)
+        if (not name or not unit or len(name) > MAX_LENGTH
+                or len(unit) > MAX_LENGTH or key in seen):
+            stats['skipped'] += 1
+            continue
+        seen.add(key)
+        yield key
+
+
+def chunked(iterable, size):
+    """Разбивает итератор на списки длиной size."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    """Идемпотентно загружает ингредиенты пачками.
+
+    Уже существующие пары (name, measurement_unit) не дублируются
+    благодаря ограничению unique_name_measurement, поэтому команду можно
+    запускать при каждом деплое.
+    """
+
+    help = 'Загружает ингредиенты из csv, json или jsonl.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Формат файла, по умолчанию по расширению.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY на PostgreSQL.')
+
+    def handle(self, *args, **options):
+        """Загружает файл и печатает статистику."""
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат: {file_format}.')
+        chunk_size = max(1, options['chunk_size'])
+
+        stats = {'total': 0, 'inserted': 0, 'existing': 0, 'skipped': 0}
+        rows = clean(READERS[file_format](path), stats)
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                self.load_with_copy(rows, chunk_size, stats)
+            else:
+                self.load_with_bulk_create(rows, chunk_size, stats)
+        bump_generation(INGREDIENTS_GENERATION)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано строк: {total}, добавлено: {inserted}, '
+            'уже были: {existing}, пропущено: {skipped}.'.format(**stats)))
+
+    def load_with_bulk_create(self, rows, chunk_size, stats):
+        """Загрузка через bulk_create(ignore_conflicts=True)."""
+        for chunk in chunked(rows, chunk_size):
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in chunk}
+            ).values_list('name', 'measurement_unit'))
+            new = [Ingredient(name=name, measurement_unit=unit)
+                   for name, unit in chunk if (name, unit) not in existing]
+            Ingredient.objects.bulk_create(new, batch_size=chunk_size,
+                                           ignore_conflicts=True)
+            stats['inserted'] += len(new)
+            stats['existing'] += len(chunk) - len(new)
+
+    def load_with_copy(self, rows, chunk_size, stats):
+        """Загрузка через COPY во временную таблицу и INSERT ON CONFLICT."""
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(%s), measurement_unit varchar(%s)) '
+                'ON COMMIT DROP', [MAX_LENGTH, MAX_LENGTH])
+            copy_sql = ('COPY ingredient_import (name, measurement_unit) '
+                        'FROM STDIN')
+            staged = 0
+            if is_psycopg3:
+                with cursor.copy(copy_sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                        staged += 1
+            else:
+                for chunk in chunked(rows, chunk_size):
+                    buffer = io.StringIO(''.join(
+                        '\t'.join(_copy_escape(value) for value in row)
+                        + '\n' for row in chunk))
+                    cursor.copy_expert(copy_sql, buffer)
+                    staged += len(chunk)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT name, measurement_unit FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            stats['inserted'] += cursor.rowcount
+            stats['existing'] += staged - cursor.rowcount
+            cursor.execute('DROP TABLE ingredient_import')
+
+
+def _copy_escape(value):
+    """Экранирует значение для текстового формата COPY."""
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
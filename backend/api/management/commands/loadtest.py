@@ -0,0 +1,228 @@
+"""Нагрузочный прогон запущенного сервера: запросы в секунду."""
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from api.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                        Subscription, Tag)
+from users.models import User
+
+from .benchmark import git_revision, percentile
+
+SCENARIOS = ('tag-list', 'tag-detail', 'ingredient-list', 'ingredient-detail',
+             'favorite', 'shopping-cart', 'user-subscribe')
+
+
+class Command(BaseCommand):
+    """Держит --concurrency соединений с сервером по --url.
+
+    В отличие от benchmark, ходит по HTTP в уже запущенный сервер,
+    поэтому показывает пропускную способность его воркеров: прогоните
+    команду против gunicorn (WSGI) и uvicorn (ASGI) с одинаковым числом
+    воркеров и сравните через --compare. Каждое соединение работает от
+    своего пользователя; переключатели чередуют POST и DELETE над своим
+    рецептом или автором, так что данные после прогона не меняются.
+    """
+
+    help = 'Замеряет запросы в секунду запущенного сервера.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Секунд на сценарий.')
+        parser.add_argument('--only', nargs='*', choices=SCENARIOS,
+                            default=SCENARIOS)
+        parser.add_argument('--label', default='',
+                            help='Подпись прогона, например uvicorn-1.')
+        parser.add_argument('--output', default='loadtest.json')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения.')
+
+    def handle(self, *args, **options):
+        """Готовит данные, выполняет сценарии и сохраняет результаты."""
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url должен быть вида http://host:port.')
+        self.host, self.port = url.hostname, url.port or 80
+        self.prefix = url.path.rstrip('/')
+        concurrency = max(1, options['concurrency'])
+        workers = self.get_workers(concurrency)
+
+        results = {}
+        for name in options['only']:
+            self.reset(workers)
+            try:
+                result = asyncio.run(self.run(
+                    name, workers, options['duration']))
+            finally:
+                self.reset(workers)
+            results[name] = result
+            self.stdout.write(
+                '{name:<20} {rps:>9.1f} req/s  p50 {p50_ms:>7.1f} ms  '
+                'p95 {p95_ms:>7.1f} ms  errors {errors}'.format(
+                    name=name, **result))
+
+        report = {
+            'meta': {
+                'label': options['label'],
+                'url': options['url'],
+                'revision': git_revision(),
+                'created': datetime.now(timezone.utc).isoformat(),
+                'concurrency': concurrency,
+                'duration': options['duration'],
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты записаны в {options["output"]}.'))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_workers(self, count):
+        """Для каждого соединения: токен, чужой рецепт и чужой автор."""
+        users = list(User.objects.order_by('id')[:count + 1])
+        recipes = list(Recipe.objects.order_by('-id').values_list(
+            'id', 'author_id')[:count * 2])
+        if len(users) <= count or len(recipes) < count:
+            raise CommandError('Нет данных: запустите generate_dataset.')
+        self.tag = Tag.objects.order_by('id').values_list(
+            'id', flat=True).first()
+        self.ingredient = Ingredient.objects.order_by('id').values_list(
+            'id', 'name').first()
+        if self.tag is None or self.ingredient is None:
+            raise CommandError('Нет тегов или ингредиентов.')
+
+        workers = []
+        for number, user in enumerate(users[:count]):
+            token, _ = Token.objects.get_or_create(user=user)
+            recipe_id = next(pk for pk, author_id in recipes[number:]
+                             if author_id != user.id)
+            author = users[number + 1]
+            workers.append((user.id, token.key, recipe_id, author.id))
+        return workers
+
+    def reset(self, workers):
+        """Убирает отметки, которые переключают сценарии."""
+        for user_id, _, recipe_id, author_id in workers:
+            for model in (FavoriteRecipe, ShoppingCart):
+                model.objects.filter(user_id=user_id,
+                                     recipe_id=recipe_id).delete()
+            Subscription.objects.filter(
+                user_id=user_id, subscribed_to_id=author_id).delete()
+
+    def get_requests(self, name, worker):
+        """Бесконечная последовательность (метод, путь) сценария."""
+        _, _, recipe_id, author_id = worker
+        ingredient_id, ingredient_name = self.ingredient
+        paths = {
+            'tag-list': '/api/tags/',
+            'tag-detail': f'/api/tags/{self.tag}/',
+            'ingredient-list': ('/api/ingredients/?name='
+                                + quote(ingredient_name[:2])),
+            'ingredient-detail': f'/api/ingredients/{ingredient_id}/',
+            'favorite': f'/api/recipes/{recipe_id}/favorite/',
+            'shopping-cart': f'/api/recipes/{recipe_id}/shopping_cart/',
+            'user-subscribe': f'/api/users/{author_id}/subscribe/',
+        }
+        path = self.prefix + paths[name]
+        methods = (('POST', 'DELETE') if name in
+                   ('favorite', 'shopping-cart', 'user-subscribe')
+                   else ('GET',))
+        while True:
+            for method in methods:
+                yield method, path
+
+    async def run(self, name, workers, duration):
+        """Гоняет сценарий name со всех соединений duration секунд."""
+        deadline = time.perf_counter() + duration
+        samples = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.worker(name, worker, deadline, samples)
+            for worker in workers))
+        elapsed = time.perf_counter() - start
+        durations = [duration * 1000 for duration, _ in samples] or [0]
+        statuses = sorted({status for _, status in samples})
+        return {
+            'requests': len(samples),
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(durations, 0.5), 2),
+            'p95_ms': round(percentile(durations, 0.95), 2),
+            'errors': sum(1 for _, status in samples if status >= 400),
+            'statuses': statuses,
+        }
+
+    async def worker(self, name, worker, deadline, samples):
+        """Одно соединение; без keep-alive у сервера переоткрывается."""
+        token = worker[1]
+        reader = writer = None
+        try:
+            for method, path in self.get_requests(name, worker):
+                if time.perf_counter() >= deadline:
+                    break
+                start = time.perf_counter()
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(
+                        self.host, self.port)
+                writer.write(
+                    f'{method} {path} HTTP/1.1\r\n'
+                    f'Host: {self.host}\r\n'
+                    f'Authorization: Token {token}\r\n'
+                    f'Content-Length: 0\r\n\r\n'.encode())
+                status, keep_alive = await self.read_response(reader)
+                samples.append((time.perf_counter() - start, status))
+                if not keep_alive:
+                    writer.close()
+                    reader = writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def read_response(self, reader):
+        """Читает ответ: код и можно ли продолжать в том же соединении."""
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip().lower()
+        if 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await reader.read()
+            return status, False
+        return status, headers.get('connection') != 'close'
+
+    def compare(self, path, results):
+        """Печатает изменения относительно прошлого прогона."""
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)
+        label = previous['meta'].get('label') or path
+        self.stdout.write(f'Сравнение с {label}:')
+        for name, result in results.items():
+            before = previous['results'].get(name)
+            if before is None:
+                continue
+            change = ((result['rps'] - before['rps']) / before['rps'] * 100
+                      if before['rps'] else 0)
+            self.stdout.write(
+                f'{name:<20} {before["rps"]:>9.1f} -> '
+                f'{result["rps"]:>9.1f} req/s ({change:+.0f}%)  '
+                f'p95 {before["p95_ms"]:.1f} -> {result["p95_ms"]:.1f} ms')
@@ -0,0 +1,61 @@
+"""Удаление файлов хранилища изображений, на которые нет ссылок."""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import MediaFile
+from api.storage import CONTENT_DIR, content_storage
+
+from .load_ingredients import chunked
+
+
+class Command(BaseCommand):
+    """Удаляет из content/ файлы без строки MediaFile.
+
+    Такие файлы остаются после отката транзакции, записавшей файл,
+    а недописанные .tmp — после падения процесса посреди записи.
+    Свежие файлы могут принадлежать еще не закоммиченной транзакции,
+    поэтому удаляются только файлы старше --min-age секунд.
+    """
+
+    help = 'Удаляет файлы изображений, на которые не ссылается MediaFile.'
+
+    def add_arguments(self, parser):
+        """Аргументы команды."""
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе, секунд.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только напечатать число файлов.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Ищет и удаляет файлы, печатает их число."""
+        storage = content_storage()
+        deadline = time.time() - options['min_age']
+        swept = 0
+        for names in chunked(self.old_files(storage, deadline),
+                             options['chunk_size']):
+            known = set(MediaFile.objects.filter(
+                name__in=names).values_list('name', flat=True))
+            for name in names:
+                if name in known:
+                    continue
+                if options['dry_run'] or storage.sweep(name):
+                    swept += 1
+        verb = 'Найдено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(f'{verb} файлов без ссылок: {swept}.')
+
+    def old_files(self, storage, deadline):
+        """Имена файлов content/, измененных раньше deadline."""
+        root = storage.path(CONTENT_DIR)
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    if os.path.getmtime(path) >= deadline:
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, storage.location).replace(
+                    os.sep, '/')
@@ -0,0 +1,134 @@
+"""Middleware проекта."""
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .timing import RequestMetrics, current_metrics
+
+logger = logging.getLogger('api.timing')
+
+
+class ServerTimingMiddleware:
+    """Заголовок Server-Timing и строка лога для каждого запроса.
+
+    Число и время SQL-запросов собираются timing.record_query, который
+    стоит на всех соединениях, время сериализации — TimedSerializerMixin.
+    Если запрос шел дольше SLOW_REQUEST_MS, в лог пишется и список его
+    запросов. Работает и под WSGI, и под ASGI; должен стоять первым
+    в MIDDLEWARE.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Сохраняет следующий обработчик цепочки."""
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Синхронные хуки Django под ASGI вызывал бы через поток.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        """Обрабатывает запрос с включенными замерами."""
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        """Асинхронный вариант __call__."""
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Засекает начало работы view."""
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        """Засекает конец view перед отложенным рендерингом ответа DRF."""
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_end = time.perf_counter()
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        """Асинхронный вариант process_view."""
+        return ServerTimingMiddleware.process_view(
+            self, request, view_func, view_args, view_kwargs)
+
+    async def aprocess_template_response(self, request, response):
+        """Асинхронный вариант process_template_response."""
+        return ServerTimingMiddleware.process_template_response(
+            self, request, response)
+
+    def report(self, request, response, metrics):
+        """Пишет Server-Timing и строку лога."""
+        end = time.perf_counter()
+        view_end = metrics.view_end or end
+        view = render = 0.0
+        if metrics.view_start is not None:
+            view = view_end - metrics.view_start
+            render = end - view_end if metrics.view_end else 0.0
+        total = end - metrics.start
+        size = None if response.streaming else len(response.content)
+
+        timings = [
+            ('db', metrics.db, f'queries={len(metrics.queries)}'),
+            ('view', view, None),
+            ('serialize', metrics.serialize, None),
+            ('render', render, None),
+            ('total', total, None),
+        ]
+        if metrics.pool is not None:
+            timings.append(('pool', metrics.pool_wait,
+                            'in_use={in_use} size={size} max={max} '
+                            'waiting={waiting}'.format(**metrics.pool)))
+        header = [f'{name};dur={duration * 1000:.1f}'
+                  + (f';desc="{desc}"' if desc else '')
+                  for name, duration, desc in timings]
+        if size is not None:
+            header.append(f'size;desc="bytes={size}"')
+        response['Server-Timing'] = ', '.join(header)
+
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': match.url_name if match else None,
+            'status': response.status_code,
+            'queries': len(metrics.queries),
+            'size': size,
+        }
+        record.update((f'{name}_ms', round(duration * 1000, 1))
+                      for name, duration, _ in timings)
+        if metrics.pool is not None:
+            record.update((f'pool_{name}', value)
+                          for name, value in metrics.pool.items())
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        threshold = settings.SLOW_REQUEST_MS
+        if threshold is not None and total * 1000 >= threshold:
+            record['sql'] = [
+                {'ms': round(duration * 1000, 1), 'sql': sql}
+                for sql, duration in metrics.queries]
+            logger.warning(json.dumps(record, ensure_ascii=False))
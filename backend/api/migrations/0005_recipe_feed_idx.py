@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-data_time', '-id'], name='recipe_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_recipe_feed_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='is_favorited',
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='is_in_shopping_cart',
+        ),
+        migrations.AddIndex(
+            model_name='favoriterecipe',
+            index=models.Index(fields=['recipe', 'user'], name='api_favoriterecipe_recipe_user'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['recipe', 'user'], name='api_shoppingcart_recipe_user'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='short_link',
+        ),
+    ]
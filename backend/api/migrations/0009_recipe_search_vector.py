@@ -0,0 +1,129 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_SQL = """
+CREATE FUNCTION api_recipe_search_document(
+    recipe_id bigint, recipe_name text, recipe_text text
+) RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce(recipe_name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(recipe_text, '')), 'B')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(i.name, ' ')
+            FROM api_recipeingredient ri
+            JOIN api_ingredient i ON i.id = ri.ingredient_id
+            WHERE ri.recipe_id = api_recipe_search_document.recipe_id
+        ), '')), 'C')
+$$;
+
+CREATE FUNCTION api_recipe_search_vector_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := api_recipe_search_document(
+        NEW.id, NEW.name, NEW.text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER api_recipe_search_vector
+BEFORE INSERT OR UPDATE OF name, text ON api_recipe
+FOR EACH ROW EXECUTE FUNCTION api_recipe_search_vector_update();
+
+CREATE FUNCTION api_recipeingredient_search_vector_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE api_recipe r
+        SET search_vector = api_recipe_search_document(r.id, r.name, r.text)
+        WHERE r.id IN (SELECT recipe_id FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE api_recipe r
+        SET search_vector = api_recipe_search_document(r.id, r.name, r.text)
+        WHERE r.id IN (SELECT recipe_id FROM old_rows);
+    ELSE
+        UPDATE api_recipe r
+        SET search_vector = api_recipe_search_document(r.id, r.name, r.text)
+        WHERE r.id IN (SELECT recipe_id FROM new_rows
+                       UNION SELECT recipe_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER api_recipeingredient_search_insert
+AFTER INSERT ON api_recipeingredient
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION api_recipeingredient_search_vector_update();
+
+CREATE TRIGGER api_recipeingredient_search_delete
+AFTER DELETE ON api_recipeingredient
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION api_recipeingredient_search_vector_update();
+
+CREATE TRIGGER api_recipeingredient_search_update
+AFTER UPDATE ON api_recipeingredient
+REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION api_recipeingredient_search_vector_update();
+
+CREATE FUNCTION api_ingredient_search_vector_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE api_recipe r
+    SET search_vector = api_recipe_search_document(r.id, r.name, r.text)
+    WHERE r.id IN (
+        SELECT ri.recipe_id
+        FROM api_recipeingredient ri
+        JOIN new_rows n ON n.id = ri.ingredient_id
+        JOIN old_rows o ON o.id = n.id
+        WHERE n.name IS DISTINCT FROM o.name
+    );
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER api_ingredient_search_update
+AFTER UPDATE ON api_ingredient
+REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION api_ingredient_search_vector_update();
+
+UPDATE api_recipe
+SET search_vector = api_recipe_search_document(id, name, text);
+"""
+
+REVERSE_SEARCH_SQL = """
+DROP TRIGGER api_ingredient_search_update ON api_ingredient;
+DROP FUNCTION api_ingredient_search_vector_update();
+DROP TRIGGER api_recipeingredient_search_update ON api_recipeingredient;
+DROP TRIGGER api_recipeingredient_search_delete ON api_recipeingredient;
+DROP TRIGGER api_recipeingredient_search_insert ON api_recipeingredient;
+DROP FUNCTION api_recipeingredient_search_vector_update();
+DROP TRIGGER api_recipe_search_vector ON api_recipe;
+DROP FUNCTION api_recipe_search_vector_update();
+DROP FUNCTION api_recipe_search_document(bigint, text, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_remove_recipe_short_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+        ),
+        migrations.RunSQL(SEARCH_SQL, REVERSE_SEARCH_SQL),
+    ]
@@ -1,9 +1,16 @@
 """Модели для пользователей в API."""
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.core.validators import MinValueValidator, MaxValueValidator
 from users.models import User
 
+from .storage import content_storage
+
 
 class Tag(models.Model):
     """Модель тегов."""
@@ -35,6 +42,83 @@ class Ingredient(models.Model):
         return str(self.id)
 
 
+SEARCH_CONFIG = 'russian'
+
+
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов."""
+
+    def for_detail(self, user):
+        """Подгружает всё, что нужно RecipeDetailSerializer.
+
+        Автор, ингредиенты и теги забираются фиксированным числом запросов,
+        а флаги избранного, корзины и подписки на автора вычисляются для
+        user через Exists(), поэтому число запросов не зависит от размера
+        страницы.
+        """
+        queryset = self.select_related('author').prefetch_related(
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+            'tags',
+        )
+        if user is None or not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+                author_subscribed=models.Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_subscribed=Exists(Subscription.objects.filter(
+                user=user, subscribed_to=OuterRef('author'))),
+        )
+
+    def latest_per_author(self, limit=None):
+        """Последние рецепты каждого автора, не больше limit на автора.
+
+        ROW_NUMBER() OVER (PARTITION BY author) отбирает первые limit
+        рецептов всех авторов одним запросом.
+        """
+        queryset = self.order_by('author', '-data_time', '-id')
+        if limit is None:
+            return queryset
+        return queryset.annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('data_time').desc(), F('id').desc()),
+            )
+        ).filter(row_number__lte=limit)
+
+    def search(self, text):
+        """Полнотекстовый поиск по search_vector с ранжированием.
+
+        Запрос разбирается как в поисковиках (websearch_to_tsquery),
+        совпадения ищутся по GIN-индексу и сортируются по ts_rank.
+        """
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-data_time', '-id')
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """Менеджер рецептов."""
+
+    def get_queryset(self):
+        """Не читает search_vector: он нужен только в условиях поиска.
+
+        Заодно save() загруженного рецепта не перезаписывает вектор,
+        который поддерживают триггеры БД.
+        """
+        return super().get_queryset().defer('search_vector')
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
 
@@ -54,18 +138,40 @@ class Recipe(models.Model):
                                       'приготовления 300 минут.')
         ]
     )
-    image = models.ImageField(upload_to='recipes/images/')
-    short_link = models.CharField(max_length=50,
-                                  unique=True,
-                                  blank=True, null=True)
-    is_favorited = models.BooleanField(default=False)
-    is_in_shopping_cart = models.BooleanField(default=False)
+    image = models.ImageField(upload_to='recipes/images/',
+                              storage=content_storage)
+    # Пути к уменьшенным копиям: {'small': {'webp': ..., 'jpeg': ...}}
+    image_variants = models.JSONField(default=dict, blank=True,
+                                      editable=False)
     data_time = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Заполняется триггерами из миграции 0009_recipe_search_vector:
+    # название (вес A), описание (B) и названия ингредиентов (C).
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeManager()
 
     class Meta:
         """Мета."""
 
         ordering = ['-data_time']
+        indexes = [
+            models.Index(fields=['-data_time', '-id'],
+                         name='recipe_feed_idx'),
+            GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+        ]
+
+
+class MediaFile(models.Model):
+    """Файл хранилища api.storage и число ссылок на него."""
+
+    name = models.CharField(max_length=100, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        """Возвращает name."""
+        return self.name
 
 
 class RecipeIngredient(models.Model):
@@ -90,6 +196,12 @@ class UserRecipe(models.Model):
 
         abstract = True  # Обозначает, что это абстрактный класс
         unique_together = ('user', 'recipe')
+        # (user, recipe) покрыт unique_together, обратный порядок нужен
+        # для выборок по рецепту.
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='%(app_label)s_%(class)s_recipe_user'),
+        ]
 
 
 class FavoriteRecipe(UserRecipe):
@@ -124,3 +236,15 @@ class Subscription(models.Model):
         """Мета."""
 
         unique_together = ('user', 'subscribed_to')
+
+
+def with_subscribed(queryset, user):
+    """Аннотирует пользователей флагом subscribed для зрителя user.
+
+    Подписка проверяется одним EXISTS по (user, subscribed_to) в том же
+    запросе; для анонима флаг всегда ложный.
+    """
+    if user is None or not user.is_authenticated:
+        return queryset.annotate(subscribed=models.Value(False))
+    return queryset.annotate(subscribed=Exists(Subscription.objects.filter(
+        user=user, subscribed_to=OuterRef('pk'))))
@@ -1,6 +1,13 @@
 """Классы панигинации."""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class RecipePagination(pagination.PageNumberPagination):
@@ -36,3 +43,133 @@ class UserSubscriptionPagination(pagination.PageNumberPagination):
             'previous': self.get_previous_link(),
             'results': data
         })
+
+
+class UserPagination(pagination.PageNumberPagination):
+    """Пагинация списка пользователей."""
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_paginated_response(self, data):
+        """Возвращает ответ с информацией о пагинации."""
+        return Response({
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+
+class UserCursorPagination(pagination.CursorPagination):
+    """Курсорная пагинация пользователей по id, без OFFSET и COUNT(*).
+
+    Включается параметром cursor (пустое значение — первая страница).
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = 'id'
+
+
+class RecipeCursorPagination(pagination.BasePagination):
+    """Курсорная пагинация ленты рецептов по ключу (data_time, id).
+
+    Страница выбирается условием по индексу recipe_feed_idx без OFFSET
+    и без COUNT(*), поэтому стоимость не зависит от глубины. Включается
+    параметром cursor (пустое значение — первая страница).
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Возвращает страницу после (или до) позиции из курсора."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = ('-data_time', '-id')
+        if position is not None:
+            data_time, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(data_time__gte=data_time)
+                    & ~Q(data_time=data_time, id__lte=pk))
+                ordering = ('data_time', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(data_time__lte=data_time)
+                    & ~Q(data_time=data_time, id__gte=pk))
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        """Размер страницы из параметра limit."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        """Разбирает курсор вида 'направление|data_time|id'."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            reverse, data_time, pk = base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            data_time = parse_datetime(data_time)
+            if data_time is None:
+                raise ValueError
+            return (data_time, int(pk)), reverse == '1'
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, recipe, reverse):
+        """Ссылка на страницу относительно recipe."""
+        raw = '|'.join(('1' if reverse else '0',
+                        recipe.data_time.isoformat(), str(recipe.id)))
+        encoded = base64.urlsafe_b64encode(raw.encode('ascii')).decode()
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        """Ссылка на следующую страницу."""
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        """Ссылка на предыдущую страницу."""
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(self.request.build_absolute_uri(),
+                                       self.cursor_query_param, '')
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        """Возвращает ответ без общего количества."""
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
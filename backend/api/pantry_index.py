@@ -0,0 +1,194 @@
+"""Инвертированный индекс ингредиент -> рецепты для подбора по продуктам."""
+import copy
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import bump_generation, get_generation
+from .models import RecipeIngredient
+from .routers import use_primary
+
+GENERATION = 'pantry'
+
+_index = None
+_lock = threading.Lock()
+
+
+def _change_key(generation):
+    """Ключ id рецепта, изменение которого дало поколение generation."""
+    return f'pantry:change:{generation}'
+
+
+def record_change(recipe_id):
+    """Сообщает всем процессам, что состав рецепта recipe_id изменился."""
+    generation = bump_generation(GENERATION)
+    cache.set(_change_key(generation), recipe_id,
+              settings.PANTRY_CHANGE_LOG_TIMEOUT)
+
+
+def _load(recipe_ids=None):
+    """Пары (recipe_id, ingredient_id) из БД, все или для recipe_ids."""
+    queryset = RecipeIngredient.objects.all()
+    if recipe_ids is not None:
+        queryset = queryset.filter(recipe_id__in=recipe_ids)
+    return queryset.values_list('recipe_id', 'ingredient_id').distinct()
+
+
+class PantryIndex:
+    """Списки рецептов по ингредиентам в массивах numpy.
+
+    Рецептам выдаются плотные номера: для каждого ингредиента хранится
+    отсортированный массив номеров его рецептов, для каждого номера —
+    id рецепта и число его ингредиентов. Тогда rank — это bincount
+    по склеенным спискам и сравнение с числом ингредиентов без цикла
+    на Python. Индекс не меняется после построения: apply возвращает
+    новый, а get_pantry_index подменяет ссылку на него, поэтому
+    параллельный поиск всегда видит целое состояние.
+    """
+
+    def __init__(self, pairs, generation):
+        """Строит индекс из пар (recipe_id, ingredient_id)."""
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in pairs:
+            recipes[recipe_id].append(ingredient_id)
+        self.generation = generation
+        self._recipes = {recipe_id: tuple(ids)
+                         for recipe_id, ids in recipes.items()}
+        self._positions = {recipe_id: position for position, recipe_id
+                           in enumerate(sorted(self._recipes))}
+        self._ids = np.fromiter(self._positions, dtype=np.int64,
+                                count=len(self._positions))
+        postings = defaultdict(list)
+        sizes = []
+        for position, recipe_id in enumerate(self._positions):
+            ingredients = self._recipes[recipe_id]
+            sizes.append(len(ingredients))
+            for ingredient_id in ingredients:
+                postings[ingredient_id].append(position)
+        self._sizes = np.array(sizes, dtype=np.int64)
+        self._postings = {
+            ingredient_id: np.array(positions, dtype=np.int64)
+            for ingredient_id, positions in postings.items()}
+
+    def __len__(self):
+        """Количество рецептов в индексе."""
+        return len(self._recipes)
+
+    def apply(self, recipe_ids, generation):
+        """Новый индекс, в котором состав recipe_ids перечитан из БД.
+
+        Сам индекс не меняется: словари копируются, а затронутые
+        массивы строятся заново. Удаленный рецепт оставляет в массивах
+        пустой номер с нулем ингредиентов, он не попадает ни в один
+        список; такие номера исчезают при полной перестройке.
+        """
+        fresh = defaultdict(list)
+        for recipe_id, ingredient_id in _load(recipe_ids):
+            fresh[recipe_id].append(ingredient_id)
+        index = copy.copy(self)
+        index.generation = generation
+        index._recipes = dict(self._recipes)
+        index._positions = dict(self._positions)
+        index._postings = dict(self._postings)
+        sizes = self._sizes.copy()
+        added_ids = []
+        inserted, removed = defaultdict(list), defaultdict(list)
+        for recipe_id in recipe_ids:
+            old = set(self._recipes.get(recipe_id, ()))
+            new = set(fresh.get(recipe_id, ()))
+            position = index._positions.get(recipe_id)
+            if position is None:
+                if not new:
+                    continue
+                position = len(self._ids) + len(added_ids)
+                index._positions[recipe_id] = position
+                added_ids.append(recipe_id)
+            for ingredient_id in old - new:
+                removed[ingredient_id].append(position)
+            for ingredient_id in new - old:
+                inserted[ingredient_id].append(position)
+            if new:
+                index._recipes[recipe_id] = tuple(new)
+            else:
+                index._recipes.pop(recipe_id, None)
+                del index._positions[recipe_id]
+            if position < len(sizes):
+                sizes[position] = len(new)
+        index._ids = np.concatenate(
+            [self._ids, np.array(added_ids, dtype=np.int64)])
+        index._sizes = np.concatenate(
+            [sizes, np.fromiter(
+                (len(index._recipes[recipe_id]) for recipe_id in added_ids),
+                dtype=np.int64, count=len(added_ids))])
+        for ingredient_id in inserted.keys() | removed.keys():
+            positions = self._postings.get(
+                ingredient_id, np.empty(0, dtype=np.int64))
+            positions = np.setdiff1d(positions, removed[ingredient_id])
+            positions = np.union1d(
+                positions, np.array(inserted[ingredient_id], dtype=np.int64))
+            if len(positions):
+                index._postings[ingredient_id] = positions
+            else:
+                index._postings.pop(ingredient_id, None)
+        return index
+
+    def rank(self, ingredient_ids, max_missing=None):
+        """Рецепты по убыванию числа имеющихся ингредиентов.
+
+        Возвращает список (recipe_id, covered, missing): covered —
+        сколько ингредиентов рецепта есть в ingredient_ids, missing —
+        сколько не хватает. При равном covered выше рецепт, которому
+        не хватает меньше, затем более новый. Рецепты без единого
+        совпадения и с недостачей больше max_missing отбрасываются.
+        """
+        postings = [self._postings[ingredient_id]
+                    for ingredient_id in set(ingredient_ids)
+                    if ingredient_id in self._postings]
+        if not postings:
+            return []
+        covered = np.bincount(np.concatenate(postings),
+                              minlength=len(self._ids))
+        positions = np.flatnonzero(covered)
+        covered = covered[positions]
+        missing = self._sizes[positions] - covered
+        if max_missing is not None:
+            fits = missing <= max_missing
+            positions, covered, missing = (
+                positions[fits], covered[fits], missing[fits])
+        ids = self._ids[positions]
+        order = np.lexsort((-ids, missing, -covered))
+        return list(zip(ids[order].tolist(), covered[order].tolist(),
+                        missing[order].tolist()))
+
+
+def get_pantry_index():
+    """Возвращает актуальный индекс.
+
+    Отставший индекс догоняет текущее поколение по журналу изменений
+    в кеше, перечитывая только измененные рецепты. Если журнал неполон
+    или отставание больше PANTRY_MAX_REPLAY, индекс строится заново.
+    Рецепты перечитываются с primary, а не с отстающей реплики.
+    """
+    global _index
+    generation = get_generation(GENERATION)
+    index = _index
+    if index is not None and index.generation == generation:
+        return index
+    with _lock, use_primary():
+        index = _index
+        if index is not None and index.generation == generation:
+            return index
+        if (index is not None and index.generation < generation
+                and generation - index.generation
+                <= settings.PANTRY_MAX_REPLAY):
+            keys = [_change_key(number) for number
+                    in range(index.generation + 1, generation + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                _index = index.apply(set(changes.values()), generation)
+                return _index
+        _index = PantryIndex(_load(), generation)
+        return _index
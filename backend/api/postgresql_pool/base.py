@@ -0,0 +1,132 @@
+"""PostgreSQL, берущий соединения из пула psycopg_pool.
+
+Настройки пула передаются как в Django 5.1: словарем OPTIONS['pool']
+с аргументами ConnectionPool (min_size, max_size, max_lifetime,
+max_idle, timeout) и флагом check — проверять соединение запросом
+перед выдачей. Пул один на процесс и базу; Django берет из него
+соединение при первом запросе к БД и возвращает при закрытии, то есть
+в конце HTTP-запроса, поэтому CONN_MAX_AGE должен быть 0. Служебные
+соединения без базы (создание тестовой БД) открываются без пула.
+"""
+import os
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+from django.utils.asyncio import async_unsafe
+from psycopg import IsolationLevel
+
+from api.timing import current_metrics
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_stats(pool):
+    """Заполненность пула: размер, занятые, свободные, ожидающие."""
+    stats = pool.get_stats()
+    return {
+        'max': stats['pool_max'],
+        'size': stats['pool_size'],
+        'in_use': stats['pool_size'] - stats['pool_available'],
+        'waiting': stats['requests_waiting'],
+    }
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """Закрывает пул тестовой базы перед ее удалением."""
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        """Удаляет тестовую базу, когда к ней не осталось соединений."""
+        self.connection.close_pool()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """DatabaseWrapper PostgreSQL с пулом соединений процесса.
+
+    Время ожидания соединения и заполненность пула попадают в метрики
+    запроса (api.timing), а оттуда в Server-Timing и строку лога.
+    """
+
+    creation_class = DatabaseCreation
+
+    @property
+    def pool_key(self):
+        """Ключ пула: псевдоним и адрес базы."""
+        settings_dict = self.settings_dict
+        return (self.alias, settings_dict['NAME'], settings_dict['HOST'],
+                settings_dict['PORT'], settings_dict['USER'])
+
+    @property
+    def pool(self):
+        """Пул этого процесса для базы из settings_dict."""
+        key = self.pool_key
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = self.create_pool()
+            return _pools[key]
+
+    def create_pool(self):
+        """Открывает пул с настройками из OPTIONS['pool']."""
+        if ConnectionPool is None:
+            raise ImproperlyConfigured(
+                'Для пула соединений установите psycopg-pool.')
+        options = dict(self.settings_dict['OPTIONS'].get('pool') or {})
+        check = options.pop('check', True)
+        kwargs = self.get_connection_params()
+        kwargs.setdefault('application_name', f'foodgram:{os.getpid()}')
+        return ConnectionPool(
+            kwargs=kwargs,
+            check=ConnectionPool.check_connection if check else None,
+            name=self.alias, open=True, **options)
+
+    def get_connection_params(self):
+        """Параметры соединения без настроек пула."""
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        """Соединение из пула вместо нового."""
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (IsolationLevel.READ_COMMITTED
+                                if level is None else IsolationLevel(level))
+        pool = self.pool
+        start = time.perf_counter()
+        connection = pool.getconn()
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.pool_wait += time.perf_counter() - start
+            metrics.pool = pool_stats(pool)
+        if level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def close_pool(self):
+        """Закрывает пул процесса, например перед удалением базы."""
+        with _pools_lock:
+            pool = _pools.pop(self.pool_key, None)
+        if pool is not None:
+            pool.close()
+
+    def _close(self):
+        """Возвращает соединение в пул."""
+        if self.alias == NO_DB_ALIAS:
+            return super()._close()
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,95 @@
+"""Чтение с реплик БД с привязкой пользователя к primary после записи."""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+read_database = contextvars.ContextVar('read_database', default=None)
+
+
+def _sticky_key(user_id):
+    """Ключ отметки недавней записи пользователя в кеше."""
+    return f'primary:{user_id}'
+
+
+def stick_to_primary(user_id):
+    """Следующие REPLICA_STICKY_SECONDS секунд user_id читает с primary.
+
+    Так пользователь сразу видит свои изменения, даже если реплики
+    от primary отстают.
+    """
+    if settings.DB_REPLICAS and user_id is not None:
+        cache.set(_sticky_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def route_reads(request):
+    """Направляет чтения запроса на случайную реплику, если можно.
+
+    Можно, если реплики настроены, метод безопасный и пользователь
+    ничего не писал последние REPLICA_STICKY_SECONDS секунд. Возвращает
+    токен для reset_reads или None.
+    """
+    if not settings.DB_REPLICAS or request.method not in SAFE_METHODS:
+        return None
+    user_id = getattr(request.user, 'pk', None)
+    if user_id is not None and cache.get(_sticky_key(user_id)) is not None:
+        return None
+    return read_database.set(random.choice(settings.DB_REPLICAS))
+
+
+async def aroute_reads(request):
+    """Асинхронный route_reads для view из api.async_views."""
+    if not settings.DB_REPLICAS or request.method not in SAFE_METHODS:
+        return None
+    user_id = getattr(request.user, 'pk', None)
+    if (user_id is not None
+            and await cache.aget(_sticky_key(user_id)) is not None):
+        return None
+    return read_database.set(random.choice(settings.DB_REPLICAS))
+
+
+def reset_reads(token):
+    """Возвращает чтения на primary после route_reads."""
+    if token is not None:
+        read_database.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Читает с primary внутри блока.
+
+    Нужен там, где прочитанное кешируется под новым поколением данных:
+    отстающая реплика сохранила бы в кеш старое состояние.
+    """
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+class ReplicaRouter:
+    """Роутер: запись на primary, чтение — куда направил route_reads.
+
+    Реплики содержат те же данные, что и primary, поэтому связи между
+    объектами из разных баз разрешены, а миграции идут только на primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        """Реплика текущего запроса или None, то есть default."""
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        """Всегда primary."""
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Все базы — копии одной."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Миграции только на primary."""
+        return db == 'default'
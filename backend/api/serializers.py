@@ -1,12 +1,19 @@
 """Серлизаторы для моделей."""
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
+
+from .images import schedule_image_variants
+from .storage import release
 from .models import (
     User, Recipe, Ingredient, Tag, RecipeIngredient,
     FavoriteRecipe, ShoppingCart, Subscription
 )
+from .timing import TimedSerializerMixin
 
 
-class RegistrationSerializer(serializers.ModelSerializer):
+class RegistrationSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     """Сериализатор для регистрации нового пользователя."""
 
     password = serializers.CharField(write_only=True)
@@ -35,8 +42,14 @@ class LoginSerializer(serializers.Serializer):
         extra_kwargs = {'password': {'write_only': True}}
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Сериализатор для представления информации о пользователе."""
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор для представления информации о пользователе.
+
+    Флаг is_subscribed берется из аннотации subscribed (with_subscribed),
+    а без нее проверяется отдельным запросом.
+    """
+
+    is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         """Мета информация о сериализаторе."""
@@ -47,13 +60,65 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name', 'is_subscribed', 'avatar'
         ]
 
+    def get_is_subscribed(self, obj):
+        """Подписан ли текущий пользователь на obj."""
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            return Subscription.objects.filter(
+                user=request.user, subscribed_to=obj).exists()
+        return False
+
+
+class RecipeImageMixin:
+    """Ссылки на изображение рецепта и его уменьшенные копии."""
+
+    def get_image(self, obj):
+        """Ссылка на изображение.
+
+        Если в контексте передан image_variant и копия уже готова,
+        отдается она в формате jpeg, иначе оригинал.
+        """
+        variant = obj.image_variants.get(self.context.get('image_variant'))
+        if variant:
+            return self._media_url(variant['jpeg'])
+        if not obj.image:
+            return None
+        return self._media_url(obj.image.name, obj.image.storage)
+
+    def _media_url(self, name, storage=default_storage):
+        """Абсолютная ссылка на файл из хранилища storage."""
+        url = storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class RecipeShortSerializer(TimedSerializerMixin, RecipeImageMixin,
+                            serializers.ModelSerializer):
+    """Сериализатор для краткого представления рецепта."""
+
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        """Мета информация о сериализаторе."""
+
+        model = Recipe
+        fields = ['id', 'name', 'image', 'cooking_time']
+
+
+class UserSubscribedSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
+    """Сериализатор для представления подписки пользователя.
 
-class UserSubscribedSerializer(serializers.ModelSerializer):
-    """Сериализатор для представления подписки пользователя."""
+    Флаг подписки, число рецептов и сами рецепты берутся из аннотаций
+    subscribed и recipes_count и из recipes_by_author в контексте,
+    если вью их подготовила; иначе выполняются отдельные запросы.
+    """
 
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(source='recipes.count',
-                                             read_only=True)
+    recipes_count = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -68,6 +133,9 @@ class UserSubscribedSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         """Проверяет, подписан ли текущий пользователь."""
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(
@@ -75,11 +143,23 @@ class UserSubscribedSerializer(serializers.ModelSerializer):
             ).exists()
         return False
 
+    def get_recipes_count(self, obj):
+        """Количество рецептов пользователя."""
+        recipes_count = getattr(obj, 'recipes_count', None)
+        if recipes_count is None:
+            return obj.recipe_set.count()
+        return recipes_count
+
     def get_recipes(self, obj):
         """Получает рецепты, созданные пользователем."""
-        recipes = Recipe.objects.filter(
-            author=obj)[:self.context.get('recipes_limit', None)]
-        return RecipeSerializer(recipes, many=True).data
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            recipes = Recipe.objects.filter(
+                author=obj)[:self.context.get('recipes_limit', None)]
+        return RecipeShortSerializer(recipes, many=True,
+                                     context=self.context).data
 
 
 class SetPasswordSerializer(serializers.Serializer):
@@ -101,7 +181,7 @@ class SetPasswordSerializer(serializers.Serializer):
         return data
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для представления ингредиента."""
 
     class Meta:
@@ -111,7 +191,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для представления тега."""
 
     class Meta:
@@ -121,26 +201,23 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug']
 
 
-class RecipeIngredientSerializer(serializers.ModelSerializer):
-    """Сериализатор для представления ингредиентов в рецепте."""
+class RecipeIngredientSerializer(serializers.Serializer):
+    """Сериализатор для ингредиента в запросе на запись рецепта."""
 
-    ingredient = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all())
-    amount = serializers.IntegerField()
-
-    class Meta:
-        """Мета информация о сериализаторе."""
-
-        model = RecipeIngredient
-        fields = ['ingredient', 'amount']
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
 
 
 class RecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания и обновления рецептов."""
+    """Сериализатор для создания и обновления рецептов.
+
+    Ингредиенты и теги проверяются одним запросом на каждый список,
+    а при обновлении в БД пишутся только изменившиеся связи.
+    """
 
     ingredients = RecipeIngredientSerializer(many=True, write_only=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all(), write_only=True)
+    tags = serializers.ListField(child=serializers.IntegerField(),
+                                 write_only=True)
 
     class Meta:
         """Мета информация о сериализаторе."""
@@ -150,53 +227,133 @@ class RecipeSerializer(serializers.ModelSerializer):
             'id', 'author', 'name', 'text', 'ingredients',
             'tags', 'cooking_time', 'image'
         ]
-
+        read_only_fields = ['author']
+
+    def validate_ingredients(self, value):
+        """Заменяет id ингредиентов объектами Ingredient."""
+        ids = [item['id'] for item in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.')
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in ingredients]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}.')
+        return [{'ingredient': ingredients[item['id']],
+                 'amount': item['amount']} for item in value]
+
+    def validate_tags(self, value):
+        """Заменяет id тегов объектами Tag."""
+        ids = list(dict.fromkeys(value))
+        tags = Tag.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in tags]
+        if missing:
+            raise serializers.ValidationError(f'Теги не найдены: {missing}.')
+        return [tags[pk] for pk in ids]
+
+    @transaction.atomic
     def create(self, validated_data):
         """Создает новый рецепт и связывает его с ингредиентами и тегами."""
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
 
         recipe = Recipe.objects.create(**validated_data)
-
-        for ingredient_data in ingredients_data:
-            ingredient = ingredient_data['ingredient']
-            amount = ingredient_data['amount']
-            RecipeIngredient.objects.create(
-                recipe=recipe, ingredient=ingredient, amount=amount)
-
-        recipe.tags.set(tags_data)
+        schedule_image_variants(recipe)
+        recipe_ingredients = RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, **ingredient_data)
+            for ingredient_data in ingredients_data)
+        recipe.tags.add(*tags_data)
+
+        set_prefetched(recipe, 'recipe_ingredients', recipe_ingredients)
+        set_prefetched(recipe, 'tags', tags_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """
         Обновляет существующий рецепт и связывает.
 
         его с новыми ингредиентами и тегами.
         """
-        ingredients_data = validated_data.pop('ingredients')
-        tags_data = validated_data.pop('tags')
-
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get('cooking_time',
-                                                   instance.cooking_time)
-        instance.image = validated_data.get('image', instance.image)
+        ingredients_data = validated_data.pop('ingredients', None)
+        tags_data = validated_data.pop('tags', None)
+
+        old_variants = None
+        old_image = instance.image.name
+        if 'image' in validated_data:
+            old_variants = instance.image_variants
+            instance.image_variants = {}
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
         instance.save()
+        if old_variants is not None:
+            schedule_image_variants(instance, old_variants)
+            release(old_image)
+
+        if ingredients_data is not None:
+            self._update_ingredients(instance, ingredients_data)
+        if tags_data is not None:
+            self._update_tags(instance, tags_data)
+        return instance
 
-        instance.recipe_ingredients.all().delete()
+    def _update_ingredients(self, instance, ingredients_data):
+        """Применяет к рецепту только разницу в ингредиентах."""
+        current = {row.ingredient_id: row
+                   for row in instance.recipe_ingredients.all()}
+        recipe_ingredients, created, changed = [], [], []
         for ingredient_data in ingredients_data:
+            ingredient = ingredient_data['ingredient']
             amount = ingredient_data['amount']
-            RecipeIngredient.objects.create(
-                recipe=instance,
-                ingredient=ingredient_data['ingredient'],
-                amount=amount
-            )
-
-        instance.tags.set(tags_data)
-        return instance
-
-
-class RecipeDetailSerializer(serializers.ModelSerializer):
+            row = current.pop(ingredient.id, None)
+            if row is None:
+                row = RecipeIngredient(recipe=instance, ingredient=ingredient,
+                                       amount=amount)
+                created.append(row)
+            else:
+                row.ingredient = ingredient
+                if row.amount != amount:
+                    row.amount = amount
+                    changed.append(row)
+            recipe_ingredients.append(row)
+
+        if current:
+            RecipeIngredient.objects.filter(
+                pk__in=[row.pk for row in current.values()]).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if created:
+            RecipeIngredient.objects.bulk_create(created)
+        set_prefetched(instance, 'recipe_ingredients', recipe_ingredients)
+
+    def _update_tags(self, instance, tags_data):
+        """Применяет к рецепту только разницу в тегах."""
+        current = {tag.id for tag in instance.tags.all()}
+        new = {tag.id for tag in tags_data}
+        if current - new:
+            instance.tags.remove(*(current - new))
+        if new - current:
+            instance.tags.add(*(new - current))
+        set_prefetched(instance, 'tags', tags_data)
+
+
+def set_prefetched(instance, name, objects):
+    """Кладет связанные объекты в кеш prefetch_related экземпляра.
+
+    Так ответ после записи строится из данных в памяти, без повторного
+    чтения связей из БД.
+    """
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache.pop(name, None)
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache[name] = queryset
+
+
+class RecipeDetailSerializer(TimedSerializerMixin, RecipeImageMixin,
+                             serializers.ModelSerializer):
     """Сериализатор для детального представления рецепта."""
 
     ingredients = serializers.SerializerMethodField()
@@ -204,6 +361,8 @@ class RecipeDetailSerializer(serializers.ModelSerializer):
     author = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         """Мета информация о сериализаторе."""
@@ -211,10 +370,18 @@ class RecipeDetailSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = [
             'id', 'author', 'name', 'text', 'ingredients',
-            'tags', 'cooking_time', 'image', 'is_favorited',
-            'is_in_shopping_cart'
+            'tags', 'cooking_time', 'image', 'image_variants',
+            'is_favorited', 'is_in_shopping_cart'
         ]
 
+    def get_image_variants(self, obj):
+        """Ссылки на готовые уменьшенные копии изображения."""
+        return {
+            variant: {ext: self._media_url(name)
+                      for ext, name in names.items()}
+            for variant, names in obj.image_variants.items()
+        }
+
     def get_ingredients(self, obj):
         """Получает ингредиенты, связанные с рецептом."""
         ingredients = obj.recipe_ingredients.all()
@@ -233,31 +400,38 @@ class RecipeDetailSerializer(serializers.ModelSerializer):
 
     def get_author(self, obj):
         """Получает информацию об авторе рецепта."""
+        is_subscribed = getattr(obj, 'author_subscribed', None)
+        if is_subscribed is None:
+            is_subscribed = self._user_has(Subscription,
+                                           subscribed_to=obj.author_id)
         return {
             "id": obj.author.id,
             "username": obj.author.username,
             "first_name": obj.author.first_name,
             "last_name": obj.author.last_name,
             "avatar": obj.author.avatar.url if obj.author.avatar else None,
-            "is_subscribed": obj.author.is_subscribed
+            "is_subscribed": is_subscribed
         }
 
     def get_is_favorited(self, obj):
         """Проверяет, добавлен ли рецепт в избранное пользователем."""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return FavoriteRecipe.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
-        return False
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is None:
+            return self._user_has(FavoriteRecipe, recipe=obj)
+        return is_favorited
 
     def get_is_in_shopping_cart(self, obj):
         """Проверяет, находится ли рецепт в корзине покупок пользователя."""
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is None:
+            return self._user_has(ShoppingCart, recipe=obj)
+        return is_in_shopping_cart
+
+    def _user_has(self, model, **lookup):
+        """Запрос-фолбэк для рецептов без аннотаций Recipe.for_detail."""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return ShoppingCart.objects.filter(
-                user=request.user, recipe=obj
-            ).exists()
+            return model.objects.filter(user=request.user, **lookup).exists()
         return False
 
 
@@ -0,0 +1,99 @@
+"""Список покупок: агрегация в БД и выгрузка в txt, csv и pdf."""
+import csv
+import io
+import os
+
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import RecipeIngredient
+
+CHUNK_SIZE = 2000
+PDF_FONT_NAME = 'ShoppingListFont'
+
+
+def get_shopping_list(user):
+    """Возвращает итоговое количество ингредиентов из корзины user.
+
+    Один запрос SUM(amount) с группировкой по ингредиенту и единице
+    измерения; строки читаются с сервера порциями через iterator().
+    """
+    return RecipeIngredient.objects.filter(
+        recipe__shoppingcart_related__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        """Возвращает value."""
+        return value
+
+
+def render_txt(rows):
+    """Построчно отдает список покупок в текстовом виде."""
+    yield 'Список покупок:\n'
+    for name, unit, amount in rows:
+        yield f'{name} ({unit}) — {amount}\n'
+
+
+def render_csv(rows):
+    """Построчно отдает список покупок в формате csv."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(['Ингредиент', 'Единица измерения', 'Количество'])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_pdf(rows):
+    """Отдает список покупок в формате pdf.
+
+    Количество строк ограничено числом разных ингредиентов, поэтому
+    документ собирается в памяти и отдается частями.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font_name = 'Helvetica'
+    font_path = settings.SHOPPING_LIST_PDF_FONT
+    if font_path and os.path.exists(font_path):
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, font_path))
+        font_name = PDF_FONT_NAME
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top, bottom, step = height - 50, 50, 18
+    pdf.setFont(font_name, 16)
+    pdf.drawString(50, top, 'Список покупок')
+    y = top - 2 * step
+    pdf.setFont(font_name, 12)
+    for name, unit, amount in rows:
+        if y < bottom:
+            pdf.showPage()
+            pdf.setFont(font_name, 12)
+            y = top
+        pdf.drawString(50, y, f'{name} ({unit}) — {amount}')
+        y -= step
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(64 * 1024), b'')
+
+
+RENDERERS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
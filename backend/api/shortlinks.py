@@ -0,0 +1,162 @@
+"""Короткие ссылки на рецепты без хранения в БД.
+
+Код — это base62 от id рецепта, пропущенного через сети Фейстеля
+с ключом из SECRET_KEY. Перестановка обратима и взаимно однозначна,
+поэтому коллизий нет, а соседние id дают непохожие коды.
+"""
+import hashlib
+import hmac
+import string
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .cache import get_generation
+from .models import Recipe
+
+ALPHABET = string.digits + string.ascii_letters
+HALF_BITS = 24
+HALF_MASK = (1 << HALF_BITS) - 1
+MAX_ID = (1 << 2 * HALF_BITS) - 1
+ROUNDS = 4
+GENERATION = 'shortlinks'
+# 62 ** 9 > 2 ** 48, поэтому любой код не длиннее 9 символов.
+MAX_CODE_LENGTH = 9
+
+_key = None
+
+
+def _get_key():
+    """Ключ перестановки, выведенный из SECRET_KEY."""
+    global _key
+    if _key is None:
+        _key = hashlib.sha256(
+            f'api.shortlinks:{settings.SECRET_KEY}'.encode()).digest()
+    return _key
+
+
+def _round(index, half):
+    """Раундовая функция: HMAC от номера раунда и половины блока."""
+    digest = hmac.new(_get_key(), f'{index}:{half}'.encode(),
+                      hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], 'big') & HALF_MASK
+
+
+def _permute(value):
+    """Прямая перестановка 48-битного числа."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for index in range(ROUNDS):
+        left, right = right, left ^ _round(index, right)
+    return left << HALF_BITS | right
+
+
+def _unpermute(value):
+    """Обратная перестановка."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for index in reversed(range(ROUNDS)):
+        left, right = right ^ _round(index, left), left
+    return left << HALF_BITS | right
+
+
+def encode(recipe_id):
+    """Короткий код для id рецепта."""
+    if not 0 < recipe_id <= MAX_ID:
+        raise ValueError(f'id {recipe_id} вне диапазона коротких ссылок.')
+    value = _permute(recipe_id)
+    chars = []
+    while True:
+        value, digit = divmod(value, 62)
+        chars.append(ALPHABET[digit])
+        if not value:
+            return ''.join(reversed(chars))
+
+
+def decode(code):
+    """Id рецепта по короткому коду или None для некорректного кода."""
+    # Ведущий ноль запрещен, чтобы у каждого id был ровно один код.
+    if not 0 < len(code) <= MAX_CODE_LENGTH or code[0] == '0':
+        return None
+    value = 0
+    for char in code:
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            return None
+        value = value * 62 + digit
+    if value > MAX_ID:
+        return None
+    recipe_id = _unpermute(value)
+    return recipe_id or None
+
+
+class KnownRecipes:
+    """LRU id рецептов, существование которых уже проверено.
+
+    Хранятся только найденные id: отрицательный ответ не кешируется,
+    чтобы рецепт, созданный позже, сразу стал доступен по ссылке.
+    Удаление рецепта в любом процессе сдвигает поколение GENERATION,
+    и LRU, заполненный при старом поколении, очищается целиком:
+    удаления редки, а отдельного id в общем кеше не хватило бы.
+    """
+
+    def __init__(self, maxsize):
+        """Пустой кеш на maxsize id."""
+        self.maxsize = maxsize
+        self.generation = None
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def refresh(self, generation):
+        """Очищает кеш, если поколение удалений сменилось."""
+        with self._lock:
+            if self.generation != generation:
+                self._ids.clear()
+                self.generation = generation
+
+    def __contains__(self, recipe_id):
+        """Проверяет id и отмечает его как недавно использованный."""
+        with self._lock:
+            if recipe_id not in self._ids:
+                return False
+            self._ids.move_to_end(recipe_id)
+            return True
+
+    def add(self, recipe_id, generation):
+        """Запоминает id, найденный в БД при поколении generation.
+
+        Если за время проверки поколение сменилось, рецепт мог быть
+        удален, и id не запоминается.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._ids[recipe_id] = None
+            self._ids.move_to_end(recipe_id)
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def discard(self, recipe_id):
+        """Забывает id удаленного рецепта."""
+        with self._lock:
+            self._ids.pop(recipe_id, None)
+
+    def clear(self):
+        """Очищает кеш."""
+        with self._lock:
+            self._ids.clear()
+            self.generation = None
+
+
+known_recipes = KnownRecipes(settings.SHORT_LINK_CACHE_SIZE)
+
+
+def recipe_exists(recipe_id):
+    """Существует ли рецепт; найденные id запоминаются в LRU."""
+    generation = get_generation(GENERATION)
+    known_recipes.refresh(generation)
+    if recipe_id in known_recipes:
+        return True
+    if Recipe.objects.filter(pk=recipe_id).exists():
+        known_recipes.add(recipe_id, generation)
+        return True
+    return False
@@ -0,0 +1,186 @@
+"""Сигналы для инвалидации кешей."""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+from .authentication import evict_token, evict_user
+
+from .cache import (FEED_GENERATION, TAGS_GENERATION, bump_generation,
+                    touch_timestamp, viewer_timestamp)
+from .ingredient_index import GENERATION as INGREDIENTS_GENERATION
+from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Subscription, Tag)
+from .pantry_index import record_change
+from .routers import stick_to_primary
+from .shortlinks import GENERATION as SHORT_LINKS_GENERATION, known_recipes
+from .storage import release
+
+
+def bump_on_commit(*names):
+    """Сдвигает поколения после коммита текущей транзакции.
+
+    Если сдвинуть раньше, конкурентный запрос успеет закешировать
+    под новым поколением еще не закоммиченные, то есть старые, данные.
+    """
+    for name in names:
+        transaction.on_commit(partial(bump_generation, name))
+
+
+def touch_on_commit(*names):
+    """Сдвигает отметки времени после коммита текущей транзакции.
+
+    По той же причине, что и bump_on_commit: иначе конкурентный запрос
+    закеширует старые данные под новым валидатором и будет получать
+    на них 304, а откат оставит сдвинутым валидатор без изменений.
+    """
+    for name in names:
+        transaction.on_commit(partial(touch_timestamp, name))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сбрасывает индекс ингредиентов, ленту и валидаторы рецептов."""
+    bump_on_commit(INGREDIENTS_GENERATION, FEED_GENERATION)
+    touch_on_commit('catalog')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    """Сбрасывает список тегов, ленту и валидаторы рецептов."""
+    bump_on_commit(TAGS_GENERATION, FEED_GENERATION)
+    touch_on_commit('catalog')
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_feed(sender, **kwargs):
+    """Сбрасывает кеш ленты при изменении рецептов."""
+    bump_on_commit(FEED_GENERATION)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_pantry_index(sender, instance, **kwargs):
+    """Пересчитывает рецепт в индексе продуктов после коммита.
+
+    Ингредиенты пишутся bulk-операциями без сигналов, поэтому рецепт
+    отмечается по сохранению самого рецепта, а состав перечитывается
+    уже после коммита.
+    """
+    record_change_on_commit(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def update_pantry_index_ingredient(sender, instance, **kwargs):
+    """То же для правок отдельных строк, например из админки."""
+    record_change_on_commit(instance.recipe_id)
+
+
+class _RecipeChange:
+    """Отложенная до коммита запись изменения рецепта в журнал."""
+
+    def __init__(self, recipe_id):
+        self.recipe_id = recipe_id
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        record_change(self.recipe_id)
+
+
+def record_change_on_commit(recipe_id):
+    """Отмечает рецепт в журнале индекса продуктов после коммита.
+
+    queryset.delete() шлет post_delete на каждую удаленную строку
+    состава, а вместе с ними сохраняется и сам рецепт. Если изменение
+    рецепта в этой транзакции уже ждет коммита, второе не добавляется:
+    одна запись рецепта дает один сдвиг поколения. Отмененные откатом
+    ожидания Django сам убирает из run_on_commit.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for _, callback, _ in connection.run_on_commit:
+            if (isinstance(callback, _RecipeChange) and not callback.done
+                    and callback.recipe_id == recipe_id):
+                return
+    transaction.on_commit(_RecipeChange(recipe_id))
+
+
+def user_lists_changed(user_id):
+    """Отмечает изменение избранного, корзины или подписок пользователя.
+
+    Сбрасывает флаги рецептов для него и направляет его чтения
+    на primary. Вызывается сигналами и api.toggles, который пишет
+    мимо ORM.
+    """
+    touch_on_commit(viewer_timestamp(user_id))
+    stick_to_primary(user_id)
+
+
+@receiver([post_save, post_delete], sender=FavoriteRecipe)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Subscription)
+def touch_viewer(sender, instance, **kwargs):
+    """Отмечает изменение списков пользователя."""
+    user_lists_changed(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def stick_author(sender, instance, **kwargs):
+    """Автор сразу видит свой новый или измененный рецепт."""
+    stick_to_primary(instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def stick_profile(sender, instance, **kwargs):
+    """Пользователь сразу видит изменения своего профиля."""
+    stick_to_primary(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    """Убирает удаленный рецепт из LRU коротких ссылок всех процессов."""
+    known_recipes.discard(instance.pk)
+    bump_on_commit(SHORT_LINKS_GENERATION)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    """Снимает ссылку удаленного рецепта на изображение."""
+    release(instance.image.name)
+
+
+@receiver(post_delete, sender=User)
+def release_avatar(sender, instance, **kwargs):
+    """Снимает ссылку удаленного пользователя на аватар."""
+    release(instance.avatar.name)
+
+
+@receiver(post_delete, sender=Recipe)
+def touch_recipes_deleted(sender, **kwargs):
+    """Удаление не видно по updated_at, поэтому отмечается отдельно."""
+    touch_on_commit('recipes_deleted')
+
+
+@receiver(post_save, sender=User)
+def touch_users(sender, **kwargs):
+    """Данные авторов входят в представление рецептов."""
+    touch_on_commit('users')
+    bump_on_commit(FEED_GENERATION)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """Выход или удаление пользователя сразу закрывают доступ."""
+    evict_token(instance.key, instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_user(sender, instance, **kwargs):
+    """Снимок пользователя в кеше токенов больше не актуален."""
+    evict_user(instance.pk)
@@ -0,0 +1,120 @@
+"""Хранилище изображений с именами по содержимому и счетчиком ссылок.
+
+Изображения рецептов и аватары сохраняются как content/ab/<sha256>.<ext>:
+одинаковые файлы лежат на диске один раз, а раз имя зависит только
+от содержимого, файл по этому адресу никогда не меняется и nginx
+отдает его с Cache-Control immutable. Сколько полей Recipe.image
+и User.avatar ссылается на файл, хранит MediaFile; delete снимает
+одну ссылку и удаляет файл вместе с последней.
+
+Файл пишется до коммита: если транзакция откатится или процесс
+упадет, останется файл без строки MediaFile, но никогда не строка
+без файла. Такие файлы удаляет команда sweep_media.
+"""
+import hashlib
+import os
+import uuid
+from functools import partial
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import connection, transaction
+
+CONTENT_DIR = 'content'
+
+
+def content_storage():
+    """Хранилище STORAGES['content'] для полей с изображениями."""
+    return storages['content']
+
+
+def release(name):
+    """Снимает ссылку на файл name после коммита текущей транзакции."""
+    if name:
+        transaction.on_commit(partial(content_storage().delete, name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который называет файлы хешем содержимого."""
+
+    def hashed_name(self, name, content):
+        """Имя файла по sha256 содержимого с расширением из name."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        return f'{CONTENT_DIR}/{digest[:2]}/{digest}{ext}'
+
+    def _save(self, name, content):
+        """Добавляет ссылку и записывает файл, если его еще нет.
+
+        Ссылка добавляется раньше проверки файла: конкурентный delete
+        либо дождется ее и оставит файл, либо успеет удалить файл
+        до проверки, и тогда он будет записан заново. Файл пишется
+        во временный и переименовывается, чтобы по имени никогда
+        не был виден недописанный файл.
+        """
+        name = self.hashed_name(name, content)
+        self.acquire(name)
+        if not self.exists(name):
+            temp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp',
+                                      content)
+            os.replace(self.path(temp_name), self.path(name))
+        return name
+
+    def media_table(self):
+        """Таблица MediaFile."""
+        return apps.get_model('api', 'MediaFile')._meta.db_table
+
+    def acquire(self, name):
+        """Увеличивает счетчик ссылок на name одним запросом."""
+        table = self.media_table()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, refcount) VALUES (%s, 1) '
+                f'ON CONFLICT (name) DO UPDATE '
+                f'SET refcount = {table}.refcount + 1', [name])
+
+    def delete(self, name):
+        """Снимает ссылку на name; удаляет файл, если ссылок не осталось.
+
+        Файлы, сохраненные до этого хранилища, в MediaFile не учтены
+        и могут быть общими (например, картинка generate_dataset),
+        поэтому они не удаляются.
+        """
+        media_file_model = apps.get_model('api', 'MediaFile')
+        with transaction.atomic():
+            media_file = media_file_model.objects.select_for_update(
+            ).filter(name=name).first()
+            if media_file is None:
+                return
+            if media_file.refcount > 1:
+                media_file.refcount -= 1
+                media_file.save(update_fields=['refcount'])
+                return
+            media_file.delete()
+            super().delete(name)
+
+    def sweep(self, name):
+        """Удаляет файл name, если на него нет строки MediaFile.
+
+        Вместо проверки вставляется строка-заглушка: пока транзакция
+        не закончилась, конкурентный acquire того же имени ждет ее,
+        а потом, не найдя файла, записывает его заново. Временные
+        файлы _save ни в какой транзакции не участвуют и удаляются
+        сразу. Возвращает, был ли файл удален.
+        """
+        if name.endswith('.tmp'):
+            super().delete(name)
+            return True
+        table = self.media_table()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, refcount) VALUES (%s, 0) '
+                f'ON CONFLICT (name) DO NOTHING RETURNING name', [name])
+            if cursor.fetchone() is None:
+                return False
+            super().delete(name)
+            cursor.execute(f'DELETE FROM {table} WHERE name = %s', [name])
+        return True
@@ -1 +1,1223 @@
-"""Тут были тесты. Уже удалил)."""
+"""Бюджеты SQL-запросов и поведение ручек api.
+
+Каждая ручка из api/urls.py прогоняется на наборе данных двух размеров
+и с двумя размерами страницы. Число запросов не должно зависеть ни от
+того, ни от другого и не должно превышать бюджет из QUERY_BUDGETS.
+Те же проверки повторяются для асинхронных view из api.async_views.
+
+Наследники ApiTestCase проверяют поведение ручек на маленьком наборе
+данных: каждая оптимизация должна сохранять ответы.
+"""
+import base64
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter, namedtuple
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from api import feed_cache, ingredient_index, pantry_index, shortlinks
+from api.authentication import (CachedTokenAuthentication, TokenCache,
+                                token_cache)
+from api.cache import (TAGS_GENERATION, bump_generation, get_generation,
+                       get_versioned)
+from api.models import (FavoriteRecipe, Ingredient, MediaFile, Recipe,
+                        RecipeIngredient, ShoppingCart, Subscription, Tag)
+from api.storage import ContentAddressedStorage, content_storage
+from api.urls import get_urlpatterns
+from api.views import short_link_redirect
+from users.models import User
+
+# URLconf с асинхронными view для AsyncQueryBudgetTests.
+urlpatterns = [
+    path('api/', include(get_urlpatterns(async_views_enabled=True))),
+    path('s/<str:code>/', short_link_redirect, name='short-link-redirect'),
+]
+
+# Наибольшее допустимое число запросов на холодных кешах по имени URL
+# и методу: дорогая запись не должна прикрывать регрессию в чтении.
+QUERY_BUDGETS = {
+    ('user-list', 'get'): 3,
+    ('user-list', 'post'): 4,
+    ('user-detail', 'get'): 2,
+    ('tag-list', 'get'): 1,
+    ('tag-detail', 'get'): 1,
+    ('ingredient-list', 'get'): 1,
+    ('ingredient-detail', 'get'): 1,
+    ('recipe-list', 'get'): 6,
+    ('recipe-list', 'post'): 10,
+    ('recipe-detail', 'get'): 5,
+    ('recipe-detail', 'patch'): 14,
+    ('recipe-detail', 'delete'): 8,
+    ('recipe-get-link', 'get'): 2,
+    ('short-link-redirect', 'get'): 1,
+    ('recipe-pantry', 'get'): 5,
+    ('favorite', 'post'): 2,
+    ('favorite', 'delete'): 2,
+    ('shopping-cart', 'post'): 2,
+    ('shopping-cart', 'delete'): 2,
+    ('download-shopping-cart', 'get'): 2,
+    ('user-subscriptions', 'get'): 4,
+    ('user-subscribe', 'post'): 3,
+    ('user-subscribe', 'delete'): 2,
+}
+
+Route = namedtuple('Route', 'label url_name method kwargs query data anon',
+                   defaults=[None, None, None, False])
+
+ROUTES = [
+    Route('user list', 'user-list', 'get', query={'limit': '{limit}'}),
+    Route('user list, cursor', 'user-list', 'get',
+          query={'cursor': '', 'limit': '{limit}'}),
+    Route('user create', 'user-list', 'post', data='new_user', anon=True),
+    Route('user detail', 'user-detail', 'get', kwargs={'pk': 'author'}),
+    Route('users me', 'user-detail', 'get'),
+    Route('tag list', 'tag-list', 'get', anon=True),
+    Route('tag detail', 'tag-detail', 'get', kwargs={'pk': 'tag'},
+          anon=True),
+    Route('ingredient list', 'ingredient-list', 'get',
+          query={'name': 'ин', 'limit': '{limit}'}, anon=True),
+    Route('ingredient detail', 'ingredient-detail', 'get',
+          kwargs={'pk': 'ingredient'}, anon=True),
+    Route('recipe list, anonymous', 'recipe-list', 'get',
+          query={'limit': '{limit}'}, anon=True),
+    Route('recipe list', 'recipe-list', 'get', query={'limit': '{limit}'}),
+    Route('recipe list, cursor', 'recipe-list', 'get',
+          query={'cursor': '', 'limit': '{limit}'}),
+    Route('recipe list, filters', 'recipe-list', 'get',
+          query={'tags': 'lunch', 'is_favorited': '1',
+                 'is_in_shopping_cart': '1', 'limit': '{limit}'}),
+    Route('recipe list, search', 'recipe-list', 'get',
+          query={'search': 'суп', 'limit': '{limit}'}),
+    Route('recipe detail', 'recipe-detail', 'get', kwargs={'pk': 'recipe'}),
+    Route('recipe create', 'recipe-list', 'post', data='recipe_data'),
+    Route('recipe update', 'recipe-detail', 'patch',
+          kwargs={'pk': 'created'}, data='recipe_update'),
+    Route('recipe delete', 'recipe-detail', 'delete',
+          kwargs={'pk': 'created'}),
+    Route('recipe get-link', 'recipe-get-link', 'get',
+          kwargs={'id': 'recipe'}),
+    Route('short link', 'short-link-redirect', 'get',
+          kwargs={'code': 'code'}, anon=True),
+    Route('pantry', 'recipe-pantry', 'get',
+          query={'ingredients': 'pantry', 'limit': '{limit}'}),
+    Route('favorite add', 'favorite', 'post', kwargs={'id': 'other'}),
+    Route('favorite remove', 'favorite', 'delete', kwargs={'id': 'other'}),
+    Route('cart add', 'shopping-cart', 'post', kwargs={'id': 'other'}),
+    Route('cart remove', 'shopping-cart', 'delete', kwargs={'id': 'other'}),
+    Route('cart download', 'download-shopping-cart', 'get',
+          query={'file_format': 'csv'}),
+    Route('subscriptions', 'user-subscriptions', 'get',
+          query={'limit': '{limit}', 'recipes_limit': '{limit}'}),
+    Route('subscribe', 'user-subscribe', 'post',
+          kwargs={'id': 'stranger'}),
+    Route('unsubscribe', 'user-subscribe', 'delete',
+          kwargs={'id': 'stranger'}),
+]
+
+# Литералы в SQL заменяются на ?, чтобы одинаковые запросы
+# с разными параметрами давали один отпечаток.
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LISTS = re.compile(r'IN \((?:\?, )*\?\)')
+
+
+def fingerprint(sql):
+    """Отпечаток SQL без литералов."""
+    return IN_LISTS.sub('IN (...)', LITERALS.sub('?', sql))
+
+
+def image_data_uri(color=(200, 100, 50)):
+    """Небольшая png-картинка цвета color в base64."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+def reset_caches():
+    """Сбрасывает кеш и индексы процесса."""
+    cache.clear()
+    token_cache.clear()
+    ingredient_index._index = None
+    pantry_index._index = None
+    shortlinks.known_recipes.clear()
+
+
+@override_settings(RECIPE_IMAGE_WORKERS=0, SLOW_REQUEST_MS=None,
+                   DB_REPLICAS=[])
+class QueryBudgetTests(TestCase):
+    """Число запросов не растет с данными и размером страницы."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Отключает строку лога Server-Timing на время тестов."""
+        super().setUpClass()
+        cls.timing_logger = logging.getLogger('api.timing')
+        cls.timing_logger.disabled = True
+
+    @classmethod
+    def tearDownClass(cls):
+        """Возвращает лог Server-Timing."""
+        cls.timing_logger.disabled = False
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        """Зритель, справочники и первый, маленький набор данных."""
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            password='password', first_name='В', last_name='В')
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.tags = [Tag.objects.create(name=name, slug=slug)
+                    for name, slug in [('Обед', 'lunch'), ('Ужин', 'dinner')]]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(30)]
+        cls.stranger = User.objects.create_user(
+            username='stranger', email='stranger@example.com',
+            password='password', first_name='С', last_name='С')
+        cls.authors = []
+
+    def setUp(self):
+        """Клиенты и счетчик созданных пользователей."""
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.anon = APIClient()
+        self.users_created = 0
+
+    def grow(self, authors, recipes_per_author, ingredients_per_recipe):
+        """Добавляет авторов с рецептами, подписки, избранное и корзину."""
+        for _ in range(authors):
+            number = len(self.authors)
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                password='password', first_name='А', last_name='А')
+            self.authors.append(author)
+            Subscription.objects.create(user=self.viewer,
+                                        subscribed_to=author)
+            for index in range(recipes_per_author):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Суп {number}-{index}',
+                    text='Суп с овощами', cooking_time=10,
+                    image='recipes/images/test.png')
+                recipe.tags.set(self.tags)
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                     amount=10)
+                    for ingredient in self.ingredients[
+                        :ingredients_per_recipe])
+                FavoriteRecipe.objects.create(user=self.viewer,
+                                              recipe=recipe)
+                ShoppingCart.objects.create(user=self.viewer, recipe=recipe)
+        self.other = Recipe.objects.create(
+            author=self.stranger, name=f'Чужой {len(self.authors)}',
+            text='Без отметок', cooking_time=5,
+            image='recipes/images/test.png')
+
+    def test_query_counts_are_bounded(self):
+        """Ни одна ручка не делает N+1 запросов."""
+        self.grow(authors=2, recipes_per_author=2, ingredients_per_recipe=2)
+        small = self.measure_all(limit=2, ingredients=2)
+        self.grow(authors=6, recipes_per_author=5, ingredients_per_recipe=12)
+        large = self.measure_all(limit=2, ingredients=12)
+        large_page = self.measure_all(limit=20, ingredients=12)
+
+        failures = []
+        for route in ROUTES:
+            runs = {'small': small[route.label], 'large': large[route.label],
+                    'large, limit=20': large_page[route.label]}
+            counts = {name: len(queries) for name, queries in runs.items()}
+            budget = QUERY_BUDGETS[route.url_name, route.method]
+            if len(set(counts.values())) > 1 or max(counts.values()) > budget:
+                worst = max(runs, key=counts.get)
+                failures.append(self.describe(route, counts, budget,
+                                              runs[worst]))
+        self.assertFalse(failures, '\n\n'.join(failures))
+
+    def measure_all(self, limit, ingredients):
+        """Запросы каждой ручки на холодных кешах."""
+        context = {
+            'author': self.authors[0].pk,
+            'tag': self.tags[0].pk,
+            'ingredient': self.ingredients[0].pk,
+            'recipe': self.authors[0].recipe_set.order_by('id')[0].pk,
+            'other': self.other.pk,
+            'stranger': self.stranger.pk,
+            'code': shortlinks.encode(self.other.pk),
+            'pantry': [ingredient.pk for ingredient in self.ingredients[:5]],
+        }
+        self.recipe_ingredients = ingredients
+        results = {}
+        for route in ROUTES:
+            self.reset_caches()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.request(route, context, limit)
+            self.assertLess(response.status_code, 400,
+                            f'{route.label}: {response.status_code} '
+                            f'{getattr(response, "data", "")}')
+            if route.label == 'recipe create':
+                context['created'] = response.data['id']
+            results[route.label] = [query['sql'] for query in queries]
+        return results
+
+    def request(self, route, context, limit):
+        """Выполняет запрос ручки route."""
+        kwargs = {name: context[value]
+                  for name, value in (route.kwargs or {}).items()}
+        path = reverse(route.url_name, kwargs=kwargs)
+        query = {name: context.get(value, value.format(limit=limit))
+                 for name, value in (route.query or {}).items()}
+        data = getattr(self, route.data)() if route.data else None
+        client = self.anon if route.anon else self.client
+        if route.method == 'get':
+            response = client.get(path, query)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+        return getattr(client, route.method)(path, data, format='json')
+
+    def reset_caches(self):
+        """Сбрасывает все кеши, чтобы считать запросы холодного старта."""
+        reset_caches()
+
+    def new_user(self):
+        """Данные для регистрации."""
+        self.users_created += 1
+        username = f'new{self.users_created}-{User.objects.count()}'
+        return {'username': username, 'email': f'{username}@example.com',
+                'first_name': 'Н', 'last_name': 'Н', 'password': 'password'}
+
+    def recipe_data(self):
+        """Новый рецепт с ингредиентами по размеру набора данных."""
+        return {
+            'name': 'Новый суп', 'text': 'Описание', 'cooking_time': 15,
+            'image': image_data_uri(),
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in self.ingredients[:self.recipe_ingredients]],
+        }
+
+    def recipe_update(self):
+        """Правка рецепта: половина ингредиентов меняется."""
+        half = self.recipe_ingredients // 2
+        return {
+            'name': 'Суп', 'text': 'Новое описание', 'cooking_time': 20,
+            'tags': [self.tags[0].pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 7}
+                for ingredient in self.ingredients[
+                    half:half + self.recipe_ingredients]],
+        }
+
+    def describe(self, route, counts, budget, queries):
+        """Текст ошибки с повторяющимися отпечатками SQL."""
+        lines = [f'{route.label} ({route.method.upper()} {route.url_name}): '
+                 f'запросов {counts}, бюджет {budget}']
+        repeated = Counter(fingerprint(sql) for sql in queries)
+        for sql, times in repeated.most_common():
+            if times > 1:
+                lines.append(f'  {times} x {sql}')
+        return '\n'.join(lines)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncQueryBudgetTests(QueryBudgetTests):
+    """Те же бюджеты для асинхронных view."""
+
+
+class GenerationTests(SimpleTestCase):
+    """Счетчики поколений api.cache."""
+
+    def setUp(self):
+        """Пустой кеш."""
+        cache.clear()
+
+    def test_evicted_generation_does_not_repeat(self):
+        """После вытеснения счетчика старые записи не читаются снова."""
+        before = bump_generation(TAGS_GENERATION)
+        self.assertEqual(get_versioned(TAGS_GENERATION, lambda: 'old'),
+                         'old')
+        cache.delete(f'generation:{TAGS_GENERATION}')
+        after = bump_generation(TAGS_GENERATION)
+        self.assertGreater(after, before)
+        self.assertEqual(get_versioned(TAGS_GENERATION, lambda: 'new'),
+                         'new')
+
+
+@override_settings(RECIPE_IMAGE_WORKERS=0, SLOW_REQUEST_MS=None,
+                   DB_REPLICAS=[])
+class ApiTestCase(TestCase):
+    """Основа тестов поведения: автор, зритель, теги и ингредиенты.
+
+    Файлы пишутся во временный MEDIA_ROOT, кеши сбрасываются перед
+    каждым тестом.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Временный MEDIA_ROOT и отключенный лог Server-Timing."""
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        logging.getLogger('api.timing').disabled = True
+
+    @classmethod
+    def tearDownClass(cls):
+        """Удаляет MEDIA_ROOT и возвращает лог."""
+        logging.getLogger('api.timing').disabled = False
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        """Пользователи и справочники."""
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            password='password', first_name='В', last_name='В')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='А', last_name='А')
+        cls.tags = [Tag.objects.create(name=name, slug=slug)
+                    for name, slug in [('Обед', 'lunch'), ('Ужин', 'dinner')]]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('картофель', 'морковь', 'лук', 'соль')]
+
+    def setUp(self):
+        """Клиенты зрителя и анонима, пустые кеши."""
+        reset_caches()
+        self.client = self.client_for(self.viewer)
+        self.anon = APIClient()
+
+    def client_for(self, user):
+        """Клиент с токеном user."""
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def create_recipe(self, author=None, ingredients=(), tags=(), **fields):
+        """Рецепт через ORM с ингредиентами по 10 единиц."""
+        fields = {'name': 'Суп', 'text': 'Суп с овощами',
+                  'cooking_time': 10, 'image': 'recipes/images/test.png',
+                  **fields}
+        recipe = Recipe.objects.create(author=author or self.author,
+                                       **fields)
+        recipe.tags.set(tags)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in ingredients)
+        return recipe
+
+    def recipe_data(self, **fields):
+        """Данные рецепта для POST /api/recipes/."""
+        return {
+            'name': 'Новый суп', 'text': 'Описание', 'cooking_time': 15,
+            'image': image_data_uri(), 'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 5}],
+            **fields,
+        }
+
+
+class FeedCacheTests(ApiTestCase):
+    """Кеш анонимной ленты."""
+
+    def test_new_recipe_invalidates_anonymous_feed(self):
+        """Новый рецепт сбрасывает закешированную ленту."""
+        self.create_recipe(name='Старый')
+        url = reverse('recipe-list')
+        self.assertEqual(self.anon.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.anon.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client_for(self.author).post(
+                url, self.recipe_data(), format='json')
+        self.assertEqual(created.status_code, 201)
+
+        response = self.anon.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(created.data['id'],
+                      [recipe['id'] for recipe in response.json()['results']])
+
+
+class FeedCacheLockTests(SimpleTestCase):
+    """Блокировка сборки страницы ленты."""
+
+    def setUp(self):
+        """Пустой кеш."""
+        cache.clear()
+
+    @override_settings(FEED_CACHE_LOCK_TIMEOUT=0.05,
+                       FEED_CACHE_LOCK_POLL=0.01)
+    def test_foreign_lock_is_kept(self):
+        """Не дождавшийся запрос не снимает чужую блокировку."""
+        cache.set('feed:test:lock', 'other', 60)
+        self.assertEqual(feed_cache.get_or_build('feed:test', lambda: 1),
+                         (1, False))
+        self.assertEqual(cache.get('feed:test:lock'), 'other')
+
+    def test_own_lock_is_released(self):
+        """Своя блокировка снимается и после ошибки сборки."""
+        def build():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            feed_cache.get_or_build('feed:test', build)
+        self.assertIsNone(cache.get('feed:test:lock'))
+        self.assertEqual(feed_cache.get_or_build('feed:test', lambda: 2),
+                         (2, False))
+        self.assertEqual(feed_cache.get_or_build('feed:test', lambda: 3),
+                         (2, True))
+
+
+class ConditionalRequestTests(ApiTestCase):
+    """ETag и 304 для рецепта."""
+
+    def setUp(self):
+        """Рецепт с ингредиентом и тегом."""
+        super().setUp()
+        self.recipe = self.create_recipe(ingredients=self.ingredients[:1],
+                                         tags=self.tags[:1])
+        self.url = reverse('recipe-detail', kwargs={'pk': self.recipe.pk})
+
+    def test_unchanged_recipe_is_not_modified(self):
+        """Повторный запрос с ETag получает 304."""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_ingredient_rename_changes_etag(self):
+        """Переименованный ингредиент виден, а не закрыт 304."""
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[0].name = 'батат'
+            self.ingredients[0].save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ingredients'][0]['name'], 'батат')
+
+    def test_tag_rename_changes_etag(self):
+        """То же для тега."""
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tags[0].name = 'Завтрак'
+            self.tags[0].save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'][0]['name'], 'Завтрак')
+
+    def test_validators_move_after_commit(self):
+        """До коммита ETag прежний, после коммита — новый."""
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            FavoriteRecipe.objects.create(user=self.viewer,
+                                          recipe=self.recipe)
+            self.assertEqual(self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_non_numeric_id_is_not_found(self):
+        """Нечисловой id — 404, а не ошибка сервера."""
+        response = self.client.get(
+            reverse('recipe-detail', kwargs={'pk': 'abc'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenRevocationTests(ApiTestCase):
+    """Выход и смена пароля видны LRU токенов всех процессов."""
+
+    def authenticate_in_other_worker(self, key):
+        """Проверяет токен через LRU другого процесса."""
+        with mock.patch('api.authentication.token_cache', self.other_worker):
+            return CachedTokenAuthentication().authenticate_credentials(key)
+
+    def setUp(self):
+        """LRU второго процесса, уже знающий токен зрителя."""
+        super().setUp()
+        self.other_worker = TokenCache(100, 60)
+        self.key = Token.objects.get(user=self.viewer).key
+        user, _ = self.authenticate_in_other_worker(self.key)
+        self.assertEqual(user.pk, self.viewer.pk)
+        self.assertIsNotNone(self.other_worker.get(self.key))
+
+    def test_logout_rejects_token_in_other_worker(self):
+        """Токен, отозванный через один LRU, не принимает другой."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'))
+        self.assertLess(response.status_code, 300)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate_in_other_worker(self.key)
+
+    def test_user_change_refreshes_other_worker(self):
+        """После изменения пользователя другой LRU перечитывает его."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.viewer.first_name = 'Новое'
+            self.viewer.save()
+        user, _ = self.authenticate_in_other_worker(self.key)
+        self.assertEqual(user.first_name, 'Новое')
+
+    def test_deleted_user_is_rejected_in_other_worker(self):
+        """Удаление пользователя закрывает токен во всех процессах."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.viewer.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate_in_other_worker(self.key)
+
+
+@override_settings(TOKEN_CACHE_SHARED=True)
+class SharedTokenCacheTests(ApiTestCase):
+    """Выход в режиме общего кеша токенов."""
+
+    def test_snapshot_cached_before_commit_is_rejected(self):
+        """Снимок, положенный конкурентным запросом до коммита, не живет."""
+        key = Token.objects.get(user=self.viewer).key
+        auth = CachedTokenAuthentication()
+        self.assertEqual(auth.authenticate_credentials(key)[0], self.viewer)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('logout'))
+            # Запрос, прочитавший токен до выхода, кеширует его снова.
+            auth.remember(key, self.viewer)
+        for callback in callbacks:
+            callback()
+        with self.assertRaises(AuthenticationFailed):
+            auth.authenticate_credentials(key)
+
+
+class RecipeSearchTests(ApiTestCase):
+    """Полнотекстовый поиск рецептов."""
+
+    def setUp(self):
+        """Совпадение в названии старше совпадения в описании."""
+        super().setUp()
+        self.in_name = self.create_recipe(name='Борщ', text='Суп')
+        self.in_text = self.create_recipe(name='Суп',
+                                          text='Почти как борщ')
+        self.create_recipe(name='Каша', text='Гречневая')
+
+    def search(self, **params):
+        """id найденных рецептов по порядку."""
+        response = self.client.get(reverse('recipe-list'),
+                                   {'search': 'борщ', **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_results_are_ranked(self):
+        """Совпадение в названии выше более нового в описании."""
+        self.assertEqual(self.search(),
+                         [self.in_name.pk, self.in_text.pk])
+
+    def test_cursor_keeps_rank_order(self):
+        """С параметром cursor порядок по релевантности сохраняется."""
+        self.assertEqual(self.search(cursor=''),
+                         [self.in_name.pk, self.in_text.pk])
+
+
+class PantryTests(ApiTestCase):
+    """Подбор рецептов по имеющимся продуктам."""
+
+    def setUp(self):
+        """Рецепты из одного, двух и трех ингредиентов."""
+        super().setUp()
+        potato, carrot, onion, _ = self.ingredients
+        with self.captureOnCommitCallbacks(execute=True):
+            self.one = self.create_recipe(ingredients=[potato])
+            self.two = self.create_recipe(ingredients=[potato, carrot])
+            self.three = self.create_recipe(
+                ingredients=[potato, carrot, onion])
+
+    def pantry(self, ingredients, **params):
+        """(id, covered_count, missing_count) найденных рецептов."""
+        response = self.client.get(
+            reverse('recipe-pantry'),
+            {'ingredients': [ingredient.pk for ingredient in ingredients],
+             **params})
+        self.assertEqual(response.status_code, 200)
+        return [(recipe['id'], recipe['covered_count'],
+                 recipe['missing_count'])
+                for recipe in response.data['results']]
+
+    def test_recipes_are_ordered_by_covered(self):
+        """Сначала больше имеющихся, при равенстве — меньше недостающих.
+
+        Рецепт из одного имеющегося ингредиента ниже рецепта, в котором
+        есть два из трех.
+        """
+        self.assertEqual(self.pantry(self.ingredients[:2]),
+                         [(self.two.pk, 2, 0), (self.three.pk, 2, 1),
+                          (self.one.pk, 1, 0)])
+
+    def test_missing_limits_results(self):
+        """missing отбрасывает рецепты с большей недостачей."""
+        self.assertEqual(self.pantry(self.ingredients[:1], missing=0),
+                         [(self.one.pk, 1, 0)])
+
+    def test_edited_recipe_is_reindexed(self):
+        """Изменение состава видно в уже построенном индексе."""
+        self.pantry(self.ingredients[:1])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.author).patch(
+                reverse('recipe-detail', kwargs={'pk': self.three.pk}),
+                self.recipe_data(ingredients=[
+                    {'id': self.ingredients[3].pk, 'amount': 1}]),
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.pantry(self.ingredients[3:]),
+                         [(self.three.pk, 1, 0)])
+        self.assertEqual(self.pantry(self.ingredients[2:3]), [])
+
+    def test_recipe_write_bumps_generation_once(self):
+        """Удаление нескольких строк состава — одно изменение рецепта."""
+        before = get_generation(pantry_index.GENERATION)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.three.recipe_ingredients.all().delete()
+            self.three.save()
+        self.assertEqual(get_generation(pantry_index.GENERATION),
+                         before + 1)
+
+
+class MediaSweepTests(ApiTestCase):
+    """Команда sweep_media."""
+
+    def save(self, content, age=None):
+        """Сохраняет файл в хранилище и при age делает его старше."""
+        name = content_storage().save('image.png', ContentFile(content))
+        if age is not None:
+            moment = time.time() - age
+            os.utime(content_storage().path(name), (moment, moment))
+        return name
+
+    def test_orphans_are_removed(self):
+        """Удаляются только старые файлы без строки MediaFile."""
+        storage = content_storage()
+        tracked = self.save(b'tracked', age=7200)
+        orphan = self.save(b'orphan', age=7200)
+        fresh = self.save(b'fresh')
+        MediaFile.objects.filter(name__in=[orphan, fresh]).delete()
+        temp = f'{orphan}.0.tmp'
+        with open(storage.path(temp), 'wb') as file:
+            file.write(b'partial')
+        os.utime(storage.path(temp), (0, 0))
+
+        call_command('sweep_media', '--dry-run', stdout=io.StringIO())
+        self.assertTrue(storage.exists(orphan))
+        call_command('sweep_media', stdout=io.StringIO())
+
+        self.assertTrue(storage.exists(tracked))
+        self.assertTrue(storage.exists(fresh))
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(storage.exists(temp))
+        self.assertFalse(MediaFile.objects.filter(name=orphan).exists())
+
+
+class ShoppingListTests(ApiTestCase):
+    """Скачивание списка покупок."""
+
+    def test_amounts_are_summed(self):
+        """Список суммирует ингредиенты всех рецептов корзины."""
+        url = reverse('download-shopping-cart')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        for ingredients in (self.ingredients[:2], self.ingredients[:1]):
+            recipe = self.create_recipe(ingredients=ingredients)
+            ShoppingCart.objects.create(user=self.viewer, recipe=recipe)
+        response = self.client.get(url, {'file_format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="shopping_cart.csv"')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(sorted(rows[1:]),
+                         ['картофель,г,20', 'морковь,г,10'])
+
+    def test_unknown_format_is_rejected(self):
+        """Неизвестный формат — 400."""
+        response = self.client.get(reverse('download-shopping-cart'),
+                                   {'file_format': 'doc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class IngredientSearchTests(ApiTestCase):
+    """Автодополнение ингредиентов из индекса в памяти."""
+
+    def names(self, **params):
+        """Названия найденных ингредиентов."""
+        response = self.anon.get(reverse('ingredient-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data]
+
+    def test_prefix_matches_come_first(self):
+        """Совпадения по началу названия идут раньше подстрок."""
+        self.assertEqual(self.names(name='Л'),
+                         ['лук', 'картофель', 'соль'])
+        self.assertEqual(self.names(name='л', limit=1), ['лук'])
+
+    def test_new_ingredient_is_searchable(self):
+        """Новый ингредиент попадает в уже построенный индекс."""
+        self.assertEqual(self.names(name='свекла'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='свекла', measurement_unit='г')
+        self.assertEqual(self.names(name='свекла'), ['свекла'])
+
+
+class RecipeCursorTests(ApiTestCase):
+    """Курсорная пагинация ленты рецептов."""
+
+    def ids(self, response):
+        """id рецептов страницы."""
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_pages_cover_feed(self):
+        """Страницы идут от новых к старым без пропусков и повторов."""
+        recipes = [self.create_recipe(name=f'Суп {number}')
+                   for number in range(5)]
+        response = self.client.get(reverse('recipe-list'),
+                                   {'cursor': '', 'limit': 2})
+        pages = [self.ids(response)]
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            pages.append(self.ids(response))
+        self.assertEqual(pages, [[recipes[4].pk, recipes[3].pk],
+                                 [recipes[2].pk, recipes[1].pk],
+                                 [recipes[0].pk]])
+        previous = self.client.get(response.json()['previous'])
+        self.assertEqual(self.ids(previous), pages[1])
+
+    def test_invalid_cursor_is_not_found(self):
+        """Испорченный курсор — 404."""
+        response = self.client.get(reverse('recipe-list'),
+                                   {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class SubscriptionsTests(ApiTestCase):
+    """Страница подписок."""
+
+    def test_recipes_limit(self):
+        """У автора recipes_limit последних рецептов и полный счетчик."""
+        self.create_recipe(name='Старый')
+        newest = self.create_recipe(name='Новый')
+        Subscription.objects.create(user=self.viewer,
+                                    subscribed_to=self.author)
+        response = self.client.get(reverse('user-subscriptions'),
+                                   {'recipes_limit': 1})
+        self.assertEqual(response.status_code, 200)
+        [author] = response.data['results']
+        self.assertEqual(author['id'], self.author.pk)
+        self.assertTrue(author['is_subscribed'])
+        self.assertEqual(author['recipes_count'], 2)
+        self.assertEqual([recipe['id'] for recipe in author['recipes']],
+                         [newest.pk])
+
+    def test_empty(self):
+        """Без подписок страница пуста."""
+        response = self.client.get(reverse('user-subscriptions'))
+        self.assertEqual(response.data['results'], [])
+
+
+class RecipeFilterTests(ApiTestCase):
+    """Фильтры ленты по тегам, автору и спискам зрителя."""
+
+    def ids(self, client, **params):
+        """id найденных рецептов."""
+        response = client.get(reverse('recipe-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def setUp(self):
+        """Рецепты с разными тегами, один в избранном, другой в корзине."""
+        super().setUp()
+        self.lunch = self.create_recipe(tags=self.tags[:1])
+        self.dinner = self.create_recipe(tags=self.tags[1:])
+        self.own = self.create_recipe(author=self.viewer, tags=self.tags)
+        FavoriteRecipe.objects.create(user=self.viewer, recipe=self.dinner)
+        ShoppingCart.objects.create(user=self.viewer, recipe=self.lunch)
+
+    def test_tags_and_author(self):
+        """Фильтры по тегу и автору."""
+        self.assertEqual(self.ids(self.client, tags='lunch'),
+                         [self.own.pk, self.lunch.pk])
+        self.assertEqual(self.ids(self.client, author=self.viewer.pk),
+                         [self.own.pk])
+
+    def test_viewer_lists(self):
+        """Избранное и корзина зрителя, в том числе с курсором."""
+        for params in ({}, {'cursor': ''}):
+            self.assertEqual(
+                self.ids(self.client, is_favorited=1, **params),
+                [self.dinner.pk])
+            self.assertEqual(
+                self.ids(self.client, is_in_shopping_cart=1, **params),
+                [self.lunch.pk])
+
+    def test_anonymous_lists_are_empty(self):
+        """У анонима избранное пусто."""
+        self.assertEqual(self.ids(self.anon, is_favorited=1), [])
+
+
+class TagListTests(ApiTestCase):
+    """Кеш и ETag списка тегов."""
+
+    def test_not_modified_until_change(self):
+        """Список тегов отдает 304 до изменения тегов."""
+        url = reverse('tag-list')
+        etag = self.anon.get(url)['ETag']
+        self.assertEqual(
+            self.anon.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Завтрак', slug='breakfast')
+        response = self.anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+
+
+class ShortLinkTests(ApiTestCase):
+    """Короткие ссылки на рецепты."""
+
+    def get_link(self, recipe_id):
+        """Путь короткой ссылки на рецепт."""
+        response = self.client.get(
+            reverse('recipe-get-link', kwargs={'id': recipe_id}))
+        self.assertEqual(response.status_code, 200)
+        return urlsplit(response.data['short-link']).path
+
+    def test_link_redirects_to_recipe(self):
+        """Ссылка ведет на страницу рецепта."""
+        recipe = self.create_recipe()
+        response = self.anon.get(self.get_link(recipe.pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'/recipes/{recipe.pk}/')
+
+    def test_link_to_deleted_recipe_is_not_found(self):
+        """После удаления рецепта ссылка не работает."""
+        recipe_id = self.create_recipe().pk
+        link = self.get_link(recipe_id)
+        Recipe.objects.filter(pk=recipe_id).delete()
+        self.assertEqual(self.anon.get(link).status_code, 404)
+        self.assertEqual(self.client.get(
+            reverse('recipe-get-link', kwargs={'id': recipe_id})
+        ).status_code, 404)
+
+    def test_deletion_is_seen_by_other_worker(self):
+        """Удаление рецепта очищает LRU существования в других процессах."""
+        recipe = self.create_recipe()
+        link = self.get_link(recipe.pk)
+        other_worker = shortlinks.KnownRecipes(100)
+        with mock.patch('api.shortlinks.known_recipes', other_worker):
+            self.assertEqual(self.anon.get(link).status_code, 302)
+            self.assertIn(recipe.pk, other_worker)
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe.delete()
+            self.assertEqual(self.anon.get(link).status_code, 404)
+
+    def test_unknown_code_is_not_found(self):
+        """Код, не полученный из id, — 404."""
+        response = self.anon.get(
+            reverse('short-link-redirect', kwargs={'code': '!!'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class UserListTests(ApiTestCase):
+    """Список пользователей."""
+
+    def test_cursor_pages_with_subscription_flag(self):
+        """Пользователи по курсору с флагом подписки зрителя."""
+        Subscription.objects.create(user=self.viewer,
+                                    subscribed_to=self.author)
+        response = self.client.get(reverse('user-list'),
+                                   {'cursor': '', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        [first] = response.data['results']
+        [second] = self.client.get(response.data['next']).data['results']
+        self.assertEqual([first['id'], second['id']],
+                         [self.viewer.pk, self.author.pk])
+        self.assertFalse(first['is_subscribed'])
+        self.assertTrue(second['is_subscribed'])
+
+    def test_page_number_pagination(self):
+        """Без cursor — страницы по номеру с общим числом."""
+        response = self.anon.get(reverse('user-list'), {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertFalse(response.data['results'][0]['is_subscribed'])
+
+
+class ServerTimingTests(ApiTestCase):
+    """Заголовок Server-Timing."""
+
+    def test_header_has_db_time(self):
+        """Ответ несет время и число запросов к БД."""
+        response = self.anon.get(reverse('tag-list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('queries=', response['Server-Timing'])
+
+
+class ContentStorageTests(ApiTestCase):
+    """Изображения с именем по содержимому и счетчиком ссылок."""
+
+    def create(self, **fields):
+        """Рецепт с изображением через API."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.author).post(
+                reverse('recipe-list'), self.recipe_data(**fields),
+                format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def delete(self, recipe):
+        """Удаляет рецепт через API."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.author).delete(
+                reverse('recipe-detail', kwargs={'pk': recipe.pk}))
+        self.assertEqual(response.status_code, 204)
+
+    def refcount(self, name):
+        """Счетчик ссылок на файл или None, если строки нет."""
+        return MediaFile.objects.filter(name=name).values_list(
+            'refcount', flat=True).first()
+
+    def test_identical_images_share_file(self):
+        """Файл удаляется вместе с последней ссылкой на него."""
+        first, second = self.create(), self.create()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(name.startswith('content/'))
+        self.assertEqual(self.refcount(name), 2)
+
+        self.delete(first)
+        self.assertEqual(self.refcount(name), 1)
+        self.assertTrue(content_storage().exists(name))
+        self.delete(second)
+        self.assertIsNone(self.refcount(name))
+        self.assertFalse(content_storage().exists(name))
+
+    def test_replaced_image_is_released(self):
+        """Замена изображения снимает ссылку на старое."""
+        recipe = self.create()
+        old_name = recipe.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.author).patch(
+                reverse('recipe-detail', kwargs={'pk': recipe.pk}),
+                self.recipe_data(image=image_data_uri((0, 0, 255))),
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.image.name, old_name)
+        self.assertEqual(self.refcount(recipe.image.name), 1)
+        self.assertIsNone(self.refcount(old_name))
+        self.assertFalse(content_storage().exists(old_name))
+
+
+class ToggleTests(ApiTestCase):
+    """Переключатели избранного, корзины и подписок."""
+
+    def setUp(self):
+        """Рецепт автора."""
+        super().setUp()
+        self.recipe = self.create_recipe(name='Суп')
+        self.detail = reverse('recipe-detail', kwargs={'pk': self.recipe.pk})
+
+    def check_recipe_toggle(self, url_name, flag):
+        """Добавление, повтор, удаление и отсутствующий рецепт."""
+        url = reverse(url_name, kwargs={'id': self.recipe.pk})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['name'], 'Суп')
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertTrue(self.client.get(self.detail).data[flag])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertFalse(self.client.get(self.detail).data[flag])
+        missing = reverse(url_name, kwargs={'id': self.recipe.pk + 100})
+        self.assertEqual(self.client.post(missing).status_code, 404)
+
+    def test_favorite(self):
+        """Избранное."""
+        self.check_recipe_toggle('favorite', 'is_favorited')
+
+    def test_shopping_cart(self):
+        """Корзина."""
+        self.check_recipe_toggle('shopping-cart', 'is_in_shopping_cart')
+
+    def test_subscribe_is_idempotent(self):
+        """Повторная подписка не дублирует строку, отписка — одна."""
+        url = reverse('user-subscribe', kwargs={'id': self.author.pk})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(Subscription.objects.filter(
+            user=self.viewer, subscribed_to=self.author).count(), 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+
+    def test_self_subscription_is_rejected(self):
+        """На себя подписаться нельзя."""
+        response = self.client.post(
+            reverse('user-subscribe', kwargs={'id': self.viewer.pk}))
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeFlagsTests(ApiTestCase):
+    """Флаги рецептов считаются для каждого зрителя отдельно."""
+
+    def test_flags_depend_on_viewer(self):
+        """Избранное, корзина и подписка зрителя не видны другим."""
+        recipe = self.create_recipe()
+        FavoriteRecipe.objects.create(user=self.viewer, recipe=recipe)
+        ShoppingCart.objects.create(user=self.viewer, recipe=recipe)
+        Subscription.objects.create(user=self.viewer,
+                                    subscribed_to=self.author)
+        for client, expected in ((self.client, True),
+                                 (self.client_for(self.author), False),
+                                 (self.anon, False)):
+            for response in (
+                    client.get(reverse('recipe-list')).json()['results'][0],
+                    client.get(reverse('recipe-detail',
+                                       kwargs={'pk': recipe.pk})).json()):
+                self.assertEqual(response['is_favorited'], expected)
+                self.assertEqual(response['is_in_shopping_cart'], expected)
+                self.assertEqual(response['author']['is_subscribed'],
+                                 expected)
+
+
+class LoadIngredientsTests(ApiTestCase):
+    """Команда load_ingredients."""
+
+    def load(self, *args):
+        """Загружает csv и возвращает вывод команды."""
+        path = os.path.join(self.media_root, 'ingredients.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('свекла,г\nсоль,г\nсвекла,г\n,г\nперец\n')
+        stdout = io.StringIO()
+        call_command('load_ingredients', path, *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_repeated_load_is_idempotent(self):
+        """Повторы и существующие строки не дублируются."""
+        for args in ((), ('--no-copy',)):
+            with self.subTest(args=args):
+                self.load(*args)
+                self.assertEqual(Ingredient.objects.filter(
+                    name__in=['свекла', 'соль']).count(), 2)
+        self.assertIn('добавлено: 0, уже были: 2, пропущено: 3',
+                      self.load())
+
+
+class RecipeUpdateTests(ApiTestCase):
+    """Изменение рецепта применяет только разницу."""
+
+    def test_ingredient_diff(self):
+        """Неизмененные строки состава остаются, лишние удаляются."""
+        potato, carrot, onion, _ = self.ingredients
+        recipe = self.create_recipe(ingredients=[potato, carrot])
+        kept = RecipeIngredient.objects.get(recipe=recipe, ingredient=carrot)
+        response = self.client_for(self.author).patch(
+            reverse('recipe-detail', kwargs={'pk': recipe.pk}),
+            self.recipe_data(ingredients=[
+                {'id': carrot.pk, 'amount': 10},
+                {'id': onion.pk, 'amount': 3}]),
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted((row['name'], row['amount'])
+                   for row in response.data['ingredients']),
+            [('лук', 3), ('морковь', 10)])
+        rows = RecipeIngredient.objects.filter(recipe=recipe)
+        self.assertEqual(set(rows.values_list('ingredient', flat=True)),
+                         {carrot.pk, onion.pk})
+        self.assertTrue(rows.filter(pk=kept.pk, amount=10).exists())
+
+    def test_invalid_update_changes_nothing(self):
+        """Ошибка проверки не оставляет частичных изменений."""
+        recipe = self.create_recipe(ingredients=self.ingredients[:1])
+        response = self.client_for(self.author).patch(
+            reverse('recipe-detail', kwargs={'pk': recipe.pk}),
+            self.recipe_data(name='Другой', ingredients=[
+                {'id': self.ingredients[1].pk, 'amount': 0}]),
+            format='json')
+        self.assertEqual(response.status_code, 400)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Суп')
+        self.assertEqual(list(recipe.recipe_ingredients.values_list(
+            'ingredient', flat=True)), [self.ingredients[0].pk])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(ApiTestCase):
+    """Асинхронные ручки отвечают так же, как синхронные."""
+
+    def test_catalog(self):
+        """Теги и ингредиенты."""
+        self.assertEqual(len(self.anon.get(reverse('tag-list')).json()), 2)
+        response = self.anon.get(reverse('ingredient-list'), {'name': 'лу'})
+        self.assertEqual([row['name'] for row in response.json()], ['лук'])
+        response = self.anon.get(
+            reverse('tag-detail', kwargs={'pk': 'abc'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_toggles(self):
+        """Избранное и подписка с кодами ответа синхронных view."""
+        recipe = self.create_recipe()
+        url = reverse('favorite', kwargs={'id': recipe.pk})
+        self.assertEqual(self.anon.post(url).status_code, 401)
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        url = reverse('user-subscribe', kwargs={'id': self.author.pk})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['recipes_count'], 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+
+
+class ImageVariantsTests(ApiTestCase):
+    """Уменьшенные копии изображения рецепта."""
+
+    def test_original_is_read_from_image_storage(self):
+        """Копии строятся, даже если оригиналы лежат не в MEDIA_ROOT."""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        storage = ContentAddressedStorage(location=location,
+                                          base_url='/content-media/')
+        field = Recipe._meta.get_field('image')
+        with mock.patch.object(field, 'storage', storage):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client_for(self.author).post(
+                    reverse('recipe-list'), self.recipe_data(),
+                    format='json')
+            self.assertEqual(response.status_code, 201)
+            recipe = Recipe.objects.get(pk=response.data['id'])
+            self.assertTrue(storage.exists(recipe.image.name))
+            self.assertTrue(response.data['image'].startswith(
+                'http://testserver/content-media/content/'))
+        self.assertEqual(set(recipe.image_variants),
+                         set(settings.RECIPE_IMAGE_VARIANTS))
+        for names in recipe.image_variants.values():
+            for name in names.values():
+                self.assertTrue(default_storage.exists(name))
@@ -0,0 +1,77 @@
+"""Замеры времени обработки запроса: БД, view, сериализация, рендеринг."""
+import contextvars
+import time
+
+current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса.
+
+    Времена хранятся в секундах; запросы к БД копятся вместе с SQL,
+    чтобы медленный запрос можно было разобрать по логу.
+    """
+
+    def __init__(self):
+        """Обнуляет счетчики и засекает начало запроса."""
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.view_end = None
+        self.db = 0.0
+        self.serialize = 0.0
+        self.queries = []
+        self.serializing = False
+        # Ожидание соединения из пула и заполненность пула после выдачи,
+        # если включен DB_POOL_MODE=pool.
+        self.pool_wait = 0.0
+        self.pool = None
+
+    def record_query(self, execute, sql, params, many, context):
+        """Обертка connection.execute_wrapper: время и текст запроса."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db += duration
+            self.queries.append((sql, duration))
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper соединений: пишет запрос в метрики текущего запроса.
+
+    Ставится на каждое соединение при подключении. Метрики берутся
+    из contextvar, поэтому запросы асинхронных view, выполненные
+    в потоке через sync_to_async, тоже учитываются.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.record_query(execute, sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Обработчик connection_created: подключает record_query."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """Учитывает время to_representation в метриках запроса.
+
+    Засекается только внешний сериализатор, поэтому вложенные
+    не считаются дважды.
+    """
+
+    def to_representation(self, instance):
+        """Сериализует instance, добавляя затраченное время в метрики."""
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializing:
+            return super().to_representation(instance)
+        metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializing = False
+            metrics.serialize += time.perf_counter() - start
@@ -0,0 +1,136 @@
+"""Переключатели избранного, корзины и подписок одним SQL-запросом.
+
+Проверка существования рецепта или автора, вставка или удаление
+отметки и выборка данных для ответа делаются одним выражением
+INSERT ... ON CONFLICT DO NOTHING или DELETE ... RETURNING. Повторный
+или одновременный запрос не падает на unique_together, а просто
+ничего не вставляет. Запросы идут мимо ORM и его сигналов, поэтому
+изменения отмечаются через signals.user_lists_changed.
+"""
+from django.db import connections
+
+from users.models import User
+
+from .models import Recipe, Subscription
+from .signals import user_lists_changed
+
+ADD_RECIPE_SQL = '''
+    WITH recipe AS (
+        SELECT id, name, image, cooking_time FROM {recipe} WHERE id = %s
+    ), inserted AS (
+        INSERT INTO {table} (user_id, recipe_id)
+        SELECT %s, id FROM recipe
+        ON CONFLICT (user_id, recipe_id) DO NOTHING
+        RETURNING recipe_id
+    )
+    SELECT recipe.*, EXISTS (SELECT 1 FROM inserted) AS added
+    FROM recipe
+'''
+
+REMOVE_RECIPE_SQL = '''
+    WITH recipe AS (
+        SELECT id FROM {recipe} WHERE id = %s
+    ), deleted AS (
+        DELETE FROM {table}
+        WHERE user_id = %s AND recipe_id IN (SELECT id FROM recipe)
+        RETURNING recipe_id
+    )
+    SELECT EXISTS (SELECT 1 FROM deleted) FROM recipe
+'''
+
+SUBSCRIBE_SQL = '''
+    WITH author AS (
+        SELECT id, email, username, first_name, last_name, avatar
+        FROM {user} WHERE id = %s
+    ), inserted AS (
+        INSERT INTO {table} (user_id, subscribed_to_id)
+        SELECT %s, id FROM author
+        ON CONFLICT (user_id, subscribed_to_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT author.*,
+           (SELECT count(*) FROM {recipe} WHERE author_id = author.id)
+           AS recipes_count,
+           EXISTS (SELECT 1 FROM inserted) AS added
+    FROM author
+'''
+
+UNSUBSCRIBE_SQL = '''
+    WITH author AS (
+        SELECT id FROM {user} WHERE id = %s
+    ), deleted AS (
+        DELETE FROM {table}
+        WHERE user_id = %s AND subscribed_to_id IN (SELECT id FROM author)
+        RETURNING id
+    )
+    SELECT EXISTS (SELECT 1 FROM deleted) FROM author
+'''
+
+
+def tables(model):
+    """Имена таблиц для подстановки в SQL переключателя model."""
+    return {'table': model._meta.db_table,
+            'recipe': Recipe._meta.db_table,
+            'user': User._meta.db_table}
+
+
+def add_recipe(model, user_id, recipe_id):
+    """Добавляет рецепт в список model пользователя.
+
+    Возвращает None, если рецепта нет, иначе рецепт с флагом added:
+    False, если он уже был в списке.
+    """
+    recipes = list(Recipe.objects.raw(
+        ADD_RECIPE_SQL.format(**tables(model)), [recipe_id, user_id],
+        using='default'))
+    if recipes and recipes[0].added:
+        user_lists_changed(user_id)
+    return recipes[0] if recipes else None
+
+
+def remove_recipe(model, user_id, recipe_id):
+    """Убирает рецепт из списка model пользователя.
+
+    Возвращает None, если рецепта нет, иначе был ли он в списке.
+    """
+    return _remove(REMOVE_RECIPE_SQL.format(**tables(model)),
+                   user_id, recipe_id)
+
+
+def subscribe(user_id, author_id):
+    """Подписывает пользователя на автора.
+
+    Возвращает None, если автора нет, иначе автора с аннотациями
+    recipes_count и subscribed для UserSubscribedSerializer.
+    """
+    authors = list(User.objects.raw(
+        SUBSCRIBE_SQL.format(**tables(Subscription)), [author_id, user_id],
+        using='default'))
+    if not authors:
+        return None
+    author = authors[0]
+    if author.added:
+        user_lists_changed(user_id)
+    author.subscribed = True
+    return author
+
+
+def unsubscribe(user_id, author_id):
+    """Отписывает пользователя от автора.
+
+    Возвращает None, если автора нет, иначе была ли подписка.
+    """
+    return _remove(UNSUBSCRIBE_SQL.format(**tables(Subscription)),
+                   user_id, author_id)
+
+
+def _remove(sql, user_id, target_id):
+    """Выполняет DELETE переключателя и отмечает изменение."""
+    with connections['default'].cursor() as cursor:
+        cursor.execute(sql, [target_id, user_id])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[0]:
+        user_lists_changed(user_id)
+    return row[0]
@@ -1,38 +1,78 @@
 """Ручки api."""
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from api import views
-
-router = DefaultRouter()
-router.register('users', views.UserViewSet, basename='user')
-router.register('tags', views.TagViewSet, basename='tag')
-router.register('recipes', views.RecipeViewSet, basename='recipe')
-router.register('ingredients', views.IngredientViewSet, basename='ingredient')
-
-urlpatterns = [
-    path('auth/token/login/', views.LoginAPIView.as_view(), name='login'),
-    path('users/me/', views.UserDetailView.as_view(), name='user-detail'),
-    path('auth/token/logout/', views.LogoutAPIView.as_view(), name='logout'),
-    path('recipes/<int:id>/get-link/', views.RecipeViewSet.as_view(
-        {'get': 'get_link'}), name='recipe-get-link'),
-    path('s/<str:short_link>/', views.RecipeViewSet.as_view(
-        {'get': 'redirect_to_recipe'}), name='short-link-redirect'),
-    path('recipes/<int:id>/shopping_cart/',
-         views.RecipeViewSet.as_view({'post': 'shopping_cart',
-                                      'delete': 'shopping_cart'}),
-         name='shopping-cart'),
-    path('recipes/download_shopping_cart/', views.RecipeViewSet.as_view(
-        {'get': 'download_shopping_cart'}), name='download-shopping-cart'),
-    path('recipes/<int:id>/favorite/', views.RecipeViewSet.as_view(
-        {'post': 'favorite', 'delete': 'favorite'}), name='favorite'),
-    path('users/subscriptions/', views.UserSubscriptionViewSet.as_view(
-        {'get': 'subscriptions'}), name='user-subscriptions'),
-    path('users/<int:id>/subscribe/', views.UserSubscriptionViewSet.as_view(
-        {'post': 'subscribe', 'delete': 'subscribe'}),
-        name='user-subscribe'),
-
-    path('users/set_password/', views.SetPasswordAPIView.as_view(),
-         name='set-password'),
-    path('', include(router.urls)),
-    path('users/me/avatar/', views.avatar_view, name='avatar')
-]
+from api import async_views, views
+
+
+def get_urlpatterns(async_views_enabled):
+    """Ручки api с синхронными или асинхронными view.
+
+    Теги, ингредиенты и переключатели избранного, корзины и подписок
+    есть в обоих вариантах (асинхронные — в api.async_views), имена
+    ручек совпадают.
+    """
+    router = DefaultRouter()
+    router.register('users', views.UserViewSet, basename='user')
+    router.register('recipes', views.RecipeViewSet, basename='recipe')
+
+    if async_views_enabled:
+        toggles = [
+            path('tags/', async_views.tag_list, name='tag-list'),
+            path('tags/<str:pk>/', async_views.tag_detail,
+                 name='tag-detail'),
+            path('ingredients/', async_views.ingredient_list,
+                 name='ingredient-list'),
+            path('ingredients/<str:pk>/', async_views.ingredient_detail,
+                 name='ingredient-detail'),
+            path('recipes/<int:id>/shopping_cart/',
+                 async_views.shopping_cart, name='shopping-cart'),
+            path('recipes/<int:id>/favorite/', async_views.favorite,
+                 name='favorite'),
+            path('users/<int:id>/subscribe/', async_views.subscribe,
+                 name='user-subscribe'),
+        ]
+    else:
+        router.register('tags', views.TagViewSet, basename='tag')
+        router.register('ingredients', views.IngredientViewSet,
+                        basename='ingredient')
+        toggles = [
+            path('recipes/<int:id>/shopping_cart/',
+                 views.RecipeViewSet.as_view({'post': 'shopping_cart',
+                                              'delete': 'shopping_cart'}),
+                 name='shopping-cart'),
+            path('recipes/<int:id>/favorite/', views.RecipeViewSet.as_view(
+                {'post': 'favorite', 'delete': 'favorite'}),
+                name='favorite'),
+            path('users/<int:id>/subscribe/',
+                 views.UserSubscriptionViewSet.as_view(
+                     {'post': 'subscribe', 'delete': 'subscribe'}),
+                 name='user-subscribe'),
+        ]
+
+    return [
+        path('auth/token/login/', views.LoginAPIView.as_view(),
+             name='login'),
+        path('users/me/', views.UserDetailView.as_view(),
+             name='user-detail'),
+        path('auth/token/logout/', views.LogoutAPIView.as_view(),
+             name='logout'),
+        path('recipes/<int:id>/get-link/', views.RecipeViewSet.as_view(
+            {'get': 'get_link'}), name='recipe-get-link'),
+        path('recipes/download_shopping_cart/', views.RecipeViewSet.as_view(
+            {'get': 'download_shopping_cart'}),
+            name='download-shopping-cart'),
+        path('recipes/pantry/', views.RecipeViewSet.as_view(
+            {'get': 'pantry'}), name='recipe-pantry'),
+        path('users/subscriptions/', views.UserSubscriptionViewSet.as_view(
+            {'get': 'subscriptions'}), name='user-subscriptions'),
+        *toggles,
+
+        path('users/set_password/', views.SetPasswordAPIView.as_view(),
+             name='set-password'),
+        path('', include(router.urls)),
+        path('users/me/avatar/', views.avatar_view, name='avatar')
+    ]
+
+
+urlpatterns = get_urlpatterns(settings.ASYNC_VIEWS)
@@ -1,7 +1,8 @@
 """views для api."""
 from rest_framework import generics, status, permissions, viewsets
-from .models import (Tag, Recipe, Ingredient, RecipeIngredient,
-                     ShoppingCart, FavoriteRecipe, Subscription)
+from .models import (Tag, Recipe, Ingredient,
+                     ShoppingCart, FavoriteRecipe, Subscription,
+                     with_subscribed)
 from users.models import User
 from .serializers import (RegistrationSerializer, LoginSerializer,
                           UserSerializer, SetPasswordSerializer, TagSerializer,
@@ -10,19 +11,66 @@ from .serializers import (RegistrationSerializer, LoginSerializer,
 
 from rest_framework.permissions import AllowAny
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, action
+from django.db.models import Count, Max
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-from .paginators import RecipePagination, UserSubscriptionPagination
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+from django_filters.rest_framework import DjangoFilterBackend
+from .paginators import (RecipePagination, RecipeCursorPagination,
+                         UserCursorPagination, UserPagination,
+                         UserSubscriptionPagination)
+import hashlib
+import itertools
 import json
-from rest_framework import filters
+from collections import defaultdict
+from django.conf import settings
 from django.core.files.base import ContentFile
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
 import base64
-import uuid
 from django.urls import reverse
+from . import feed_cache, routers, shortlinks, toggles
+from .cache import (TAGS_GENERATION, get_generations, get_timestamp,
+                    get_versioned, viewer_timestamp)
 from .filters import RecipeFilter
+from .ingredient_index import GENERATION as INGREDIENTS_GENERATION
+from .ingredient_index import get_ingredient_index
+from .pantry_index import get_pantry_index
+from .shopping_list import RENDERERS, get_shopping_list
+from .storage import release
+
+
+def decode_image(data):
+    """Заменяет base64-картинку рецепта в data на файл."""
+    base64_image = data.get('image')
+    if base64_image and base64_image.startswith('data:image/'):
+        header, imgstr = base64_image.split(';base64,')
+        ext = header.split('/')[1]
+        file_name = f'recipe.{ext}'
+        data['image'] = ContentFile(base64.b64decode(imgstr), name=file_name)
+
+
+class ReplicaReadMixin:
+    """Безопасные запросы к view читают с реплики БД (api.routers)."""
+
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        """После аутентификации выбирает базу для чтения."""
+        super().initial(request, *args, **kwargs)
+        self.replica_token = routers.route_reads(request)
+
+    def dispatch(self, request, *args, **kwargs):
+        """Возвращает чтения на primary, даже если view упала."""
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            routers.reset_reads(self.replica_token)
 
 
 class LoginAPIView(generics.CreateAPIView):
@@ -67,8 +115,9 @@ class UserDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        """Возвращает request.user."""
-        return self.request.user
+        """Возвращает request.user с флагом подписки из аннотации."""
+        return with_subscribed(User.objects.all(), self.request.user).get(
+            pk=self.request.user.pk)
 
 
 class LogoutAPIView(generics.GenericAPIView):
@@ -125,22 +174,39 @@ class SetPasswordAPIView(generics.UpdateAPIView):
                         status=status.HTTP_200_OK)
 
 
-class UserViewSet(viewsets.ViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
     """Класс для работы с пользователями.
 
     Обрабатывает GET и POST запросы для получения и создания пользователей.
     """
 
+    serializer_class = UserSerializer
+    pagination_class = UserPagination
+
+    @property
+    def paginator(self):
+        """Курсорная пагинация, если в запросе есть параметр cursor."""
+        if (not hasattr(self, '_paginator')
+                and UserCursorPagination.cursor_query_param
+                in self.request.query_params):
+            self._paginator = UserCursorPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        """Пользователи с флагом подписки текущего пользователя."""
+        return with_subscribed(User.objects.order_by('id'),
+                               self.request.user)
+
     def list(self, request):
         """Обработка GET запроса."""
-        queryset = User.objects.all()
-        serializer = UserSerializer(queryset, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None):
         """Обработка GET запроса по pk."""
-        user = get_object_or_404(User, pk=pk)
-        serializer = UserSerializer(user)
+        user = get_object_or_404(self.get_queryset(), pk=pk)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
 
     def create(self, request):
@@ -152,18 +218,29 @@ class UserViewSet(viewsets.ViewSet):
         return Response(serializer.errors, status=400)
 
 
-class TagViewSet(viewsets.ViewSet):
+class TagViewSet(ReplicaReadMixin, viewsets.ViewSet):
     """Класс для работы с тегами.
 
     Обрабатывает GET запросы для получения списка тегов и информации
     о конкретном теге.
     """
 
+    # Теги публичны: без аутентификации запрос не обращается к БД вовсе.
+    authentication_classes = []
+
     def list(self, request):
-        """Обработка get запроса."""
-        queryset = Tag.objects.all()
-        serializer = TagSerializer(queryset, many=True)
-        return Response(serializer.data)
+        """Обработка get запроса.
+
+        Тело ответа и его ETag берутся из кеша, который сбрасывается при
+        изменении тегов; при совпадении If-None-Match отдается 304.
+        """
+        body, etag = get_versioned(TAGS_GENERATION, render_tags)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
 
     def retrieve(self, request, pk=None):
         """GET по pk."""
@@ -172,7 +249,14 @@ class TagViewSet(viewsets.ViewSet):
         return Response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def render_tags():
+    """JSON со списком тегов и его ETag."""
+    body = JSONRenderer().render(
+        TagSerializer(Tag.objects.all(), many=True).data)
+    return body, quote_etag(hashlib.md5(body).hexdigest())
+
+
+class RecipeViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """Класс для работы с рецептами.
 
     Обрабатывает CRUD операции для рецептов, включая фильтрацию,
@@ -182,37 +266,140 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     pagination_class = RecipePagination
+    filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    @property
+    def paginator(self):
+        """Курсорная пагинация, если в запросе есть параметр cursor.
+
+        Курсор идет по дате, а результаты поиска упорядочены по ts_rank,
+        поэтому с непустым search курсор игнорируется и лента делится
+        на страницы по номеру.
+        """
+        params = self.request.query_params
+        if (not hasattr(self, '_paginator') and self.action != 'pantry'
+                and RecipeCursorPagination.cursor_query_param in params
+                and not params.get('search', '').strip()):
+            self._paginator = RecipeCursorPagination()
+        return super().paginator
+
     def get_serializer_class(self):
         """Возвращает соответствующий сериализатор.
 
         в зависимости от действия.
         """
-        if self.action in ['retrieve', 'list']:
+        if self.action in ['retrieve', 'list', 'pantry']:
             return RecipeDetailSerializer
         return RecipeSerializer
 
-    def get_link(self, request, id=None):
-        """Создает короткую ссылку на рецепт.
+    def get_serializer_context(self):
+        """В ленте рецептов отдаются уменьшенные изображения."""
+        context = super().get_serializer_context()
+        if self.action in ['list', 'pantry']:
+            context['image_variant'] = 'small'
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """Лента рецептов с поддержкой условных запросов.
 
-        Если короткая ссылка еще не создана, генерирует новую.
+        Анонимам ответ вместе с валидаторами отдается из кеша ленты.
         """
-        recipe = get_object_or_404(Recipe, id=id)
+        if not request.user.is_authenticated:
+            return self.cached_list(request, *args, **kwargs)
+        etag, last_modified = self.get_list_validators(request)
+        return self.conditional_response(
+            request, etag, last_modified,
+            lambda: super(RecipeViewSet, self).list(
+                request, *args, **kwargs))
+
+    def cached_list(self, request, *args, **kwargs):
+        """Лента для анонима из кеша, сбрасываемого при любом изменении."""
+        def build():
+            etag, last_modified = self.get_list_validators(request)
+            response = super(RecipeViewSet, self).list(
+                request, *args, **kwargs)
+            return etag, last_modified, JSONRenderer().render(response.data)
+
+        (etag, last_modified, body), hit = feed_cache.get_or_build(
+            feed_cache.feed_cache_key(request), build)
+        response = self.conditional_response(
+            request, etag, last_modified,
+            lambda: HttpResponse(body, content_type='application/json'))
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
 
-        if not recipe.short_link:
-            short_link = str(uuid.uuid4())[:8]
-            recipe.short_link = short_link
-            recipe.save()
+    def retrieve(self, request, *args, **kwargs):
+        """Рецепт с поддержкой условных запросов."""
+        try:
+            recipe_id = int(kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        updated_at = Recipe.objects.filter(
+            pk=recipe_id).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(
+            request, updated_at, recipe_id)
+        return self.conditional_response(
+            request, etag, last_modified,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs))
+
+    def get_list_validators(self, request):
+        """Валидаторы ленты с учетом фильтров, одним запросом."""
+        stats = self.filter_queryset(Recipe.objects.all()).aggregate(
+            last_modified=Max('updated_at'), total=Count('id'))
+        return self.get_validators(request, stats['last_modified'],
+                                   stats['total'])
+
+    def get_validators(self, request, updated_at, key):
+        """ETag и время последнего изменения для условного запроса.
+
+        Собираются из времени изменения рецептов, удалений, авторов,
+        тегов и ингредиентов и избранного, корзины и подписок текущего
+        пользователя. Теги и ингредиенты входят в тело рецепта, поэтому
+        в ETag попадают и их поколения.
+        """
+        timestamps = [get_timestamp('recipes_deleted'),
+                      get_timestamp('users'), get_timestamp('catalog')]
+        if updated_at is not None:
+            timestamps.append(updated_at.timestamp())
+        user_id = request.user.id
+        if user_id is not None:
+            timestamps.append(get_timestamp(viewer_timestamp(user_id)))
+        last_modified = max(timestamps)
+        generations = get_generations(TAGS_GENERATION,
+                                      INGREDIENTS_GENERATION)
+        etag = quote_etag(hashlib.md5(
+            f'{key}|{last_modified}|{user_id}|{generations}'.encode()
+        ).hexdigest())
+        return etag, last_modified
+
+    def conditional_response(self, request, etag, last_modified, build):
+        """Отдает 304, если у клиента актуальная версия, иначе build()."""
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified))
+        if response is None:
+            response = build()
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
 
-        short_url = f"http://localhost:8080/s/{recipe.short_link}"
-        return Response({"short-link": short_url})
+    def get_link(self, request, id=None):
+        """Возвращает короткую ссылку на рецепт.
 
-    def redirect_to_recipe(self, request, short_link):
-        """Перенаправляет на детальную страницу рецепта по короткой ссылке."""
-        recipe = get_object_or_404(Recipe, short_link=short_link)
-        return HttpResponseRedirect(reverse('recipe-detail',
-                                            kwargs={'id': recipe.id}))
+        Код вычисляется из id, поэтому ссылка ничего не пишет в БД.
+        """
+        if not shortlinks.recipe_exists(id):
+            raise NotFound()
+        url = reverse('short-link-redirect',
+                      kwargs={'code': shortlinks.encode(id)})
+        return Response({'short-link': request.build_absolute_uri(url)})
 
     def get_queryset(self):
         """Возвращает отфильтрованный список рецептов на.
@@ -220,7 +407,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
         основе параметров запроса.
         """
         queryset = super().get_queryset()
-        # Остальные параметры фильтрации, если нужно
+        if self.action in ['retrieve', 'list', 'update', 'partial_update']:
+            queryset = queryset.for_detail(self.request.user)
         return queryset
 
     def create(self, request, *args, **kwargs):
@@ -228,51 +416,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         Сохраняет изображение и ингредиенты, привязывает автора.
         """
-        if request.user.is_authenticated:
-            request.data['author'] = request.user.id
-            base64_image = request.data['image']
-            if base64_image.startswith('data:image/'):
-                header, imgstr = base64_image.split(';base64,')
-                ext = header.split('/')[1]
-                file_name = f'recipe.{ext}'
-                image = ContentFile(base64.b64decode(imgstr), name=file_name)
-                request.data['image'] = image
-            request.data['ingredients'] = [{
-                "ingredient": ingredient['id'],
-                "amount": ingredient['amount']} for ingredient in
-                request.data['ingredients']]
-
-            serializer = self.get_serializer(data=request.data)
-            if serializer.is_valid():
-                recipe = serializer.save()
-
-                ingredients = RecipeIngredient.objects.filter(recipe=recipe)
-                ingredient_list = [{
-                    "id": ingredient.ingredient.id,
-                    "name": ingredient.ingredient.name,
-                    "measurement_unit": ingredient.ingredient.measurement_unit,
-                    "amount": ingredient.amount
-                } for ingredient in ingredients]
-
-                tags = recipe.tags.all()
-                tag_list = [{
-                    "id": tag.id,
-                    "name": tag.name,
-                    "slug": tag.slug
-                } for tag in tags]
-
-                response_data = serializer.data
-                response_data['ingredients'] = ingredient_list
-                response_data['tags'] = tag_list
-                response_data['author'] = {
-                    "id": recipe.author.id,
-                    "username": recipe.author.username
-                }
-
-                return Response(response_data, status=201)
-            return Response(serializer.errors, status=400)
-        return Response({'detail': 'Not authenticated'},
-                        status=status.HTTP_401_UNAUTHORIZED)
+        if not request.user.is_authenticated:
+            return Response({'detail': 'Not authenticated'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+        decode_image(request.data)
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            recipe = serializer.save(author=request.user)
+            # Новый рецепт еще не может быть в избранном или корзине,
+            # а на самого себя подписаться нельзя.
+            recipe.is_favorited = False
+            recipe.is_in_shopping_cart = False
+            recipe.author_subscribed = False
+            return Response(self.get_detail_data(recipe),
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=400)
 
     def update(self, request, *args, **kwargs):
         """Обновляет существующий рецепт.
@@ -286,81 +445,46 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Not authenticated'},
                             status=status.HTTP_401_UNAUTHORIZED)
 
-        request.data['author'] = request.user.id
-        base64_image = request.data.get('image')
-
-        if base64_image and base64_image.startswith('data:image/'):
-            header, imgstr = base64_image.split(';base64,')
-            ext = header.split('/')[1]
-            file_name = f'recipe.{ext}'
-            image = ContentFile(base64.b64decode(imgstr), name=file_name)
-            request.data['image'] = image
-
-        request.data['ingredients'] = [
-            {"ingredient": ingredient['id'],
-             "amount": ingredient['amount']} for ingredient in
-            request.data['ingredients']
-        ]
-
+        decode_image(request.data)
         serializer = self.get_serializer(instance, data=request.data,
                                          partial=partial)
 
         if serializer.is_valid():
             recipe = serializer.save()
-
-            RecipeIngredient.objects.filter(recipe=recipe).delete()
-
-            for ingredient_data in request.data['ingredients']:
-                ingredient_id = ingredient_data['ingredient']
-                amount = ingredient_data['amount']
-                ingredient = Ingredient.objects.get(id=ingredient_id)
-                RecipeIngredient.objects.create(recipe=recipe,
-                                                ingredient=ingredient,
-                                                amount=amount)
-
-            tags = request.data.get('tags', [])
-            recipe.tags.set(tags)
-
-            ingredients = RecipeIngredient.objects.filter(recipe=recipe)
-            ingredient_list = [{
-                "id": ingredient.ingredient.id,
-                "name": ingredient.ingredient.name,
-                "measurement_unit": ingredient.ingredient.measurement_unit,
-                "amount": ingredient.amount
-            } for ingredient in ingredients]
-
-            tags = recipe.tags.all()
-            tag_list = [{
-                "id": tag.id,
-                "name": tag.name,
-                "slug": tag.slug
-            } for tag in tags]
-
-            response_data = serializer.data
-            response_data['ingredients'] = ingredient_list
-            response_data['tags'] = tag_list
-            response_data['author'] = {
-                "id": recipe.author.id,
-                "username": recipe.author.username
-            }
-
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(self.get_detail_data(recipe),
+                            status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_detail_data(self, recipe):
+        """Представление рецепта для ответа на запись.
+
+        Связи и флаги уже лежат на экземпляре, запросов к БД нет.
+        """
+        return RecipeDetailSerializer(
+            recipe, context=self.get_serializer_context()).data
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, id=None):
         """Добавляет или удаляет рецепт из списка покупок."""
-        recipe = get_object_or_404(Recipe, id=id)
+        return self.toggle_recipe(request, ShoppingCart, id,
+                                  "Рецепт уже в списке покупок.",
+                                  "Рецепт не найден в списке покупок.")
 
+    def toggle_recipe(self, request, model, recipe_id, added, missing):
+        """Переключает рецепт в списке model одним запросом (api.toggles).
+
+        added и missing — тексты ошибок, когда рецепт уже в списке
+        и когда его там нет.
+        """
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(user=request.user,
-                                           recipe=recipe).exists():
-                return Response({"detail": "Рецепт уже в списке покупок."},
+            recipe = toggles.add_recipe(model, request.user.id, recipe_id)
+            if recipe is None:
+                raise Http404
+            if not recipe.added:
+                return Response({"detail": added},
                                 status=status.HTTP_400_BAD_REQUEST)
-
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
             return Response({
                 "id": recipe.id,
                 "name": recipe.name,
@@ -368,66 +492,99 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 "cooking_time": recipe.cooking_time
             }, status=status.HTTP_201_CREATED)
 
-        elif request.method == 'DELETE':
-            cart_item = ShoppingCart.objects.filter(user=request.user,
-                                                    recipe=recipe).first()
-            if not cart_item:
-                return Response({"detail": "Рецепт не найден в списке покупок."
-                                 },
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            cart_item.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        removed = toggles.remove_recipe(model, request.user.id, recipe_id)
+        if removed is None:
+            raise Http404
+        if not removed:
+            return Response({"detail": missing},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
             permission_classes=[permissions.IsAuthenticated])
     def download_shopping_cart(self, request):
-        """Скачивает список покупок в текстовом формате."""
-        shopping_cart_items = ShoppingCart.objects.filter(
-            user=request.user).select_related('recipe')
-        if not shopping_cart_items:
+        """Скачивает список покупок.
+
+        Формат задается параметром file_format: txt (по умолчанию),
+        csv или pdf.
+        """
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in RENDERERS:
+            return Response({"detail": "Неизвестный формат файла."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = get_shopping_list(request.user)
+        first_row = next(rows, None)
+        if first_row is None:
             return Response({"detail": "Список покупок пуст."},
                             status=status.HTTP_404_NOT_FOUND)
 
-        response_content = "Название:"
-        for item in shopping_cart_items:
-            response_content += f" {item.recipe.name}, "
-
-        response = Response(response_content, content_type='text/plain')
-        response['Content-Disposition'] = ('attachment;'
-                                           'filename="shopping_cart.txt"')
+        render, content_type = RENDERERS[file_format]
+        response = StreamingHttpResponse(
+            render(itertools.chain([first_row], rows)),
+            content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{file_format}"')
         return response
 
+    @action(detail=False, methods=['get'])
+    def pantry(self, request):
+        """Рецепты, которые можно приготовить из имеющихся продуктов.
+
+        Ингредиенты передаются id: ?ingredients=1&ingredients=2, а
+        параметр missing ограничивает число недостающих ингредиентов.
+        Рецепты идут по убыванию числа имеющихся ингредиентов, при
+        равенстве — по возрастанию числа недостающих.
+        """
+        try:
+            ingredient_ids = [
+                int(value) for value
+                in request.query_params.getlist('ingredients')]
+            max_missing = request.query_params.get('missing')
+            max_missing = None if max_missing is None else int(max_missing)
+        except ValueError:
+            return Response(
+                {"detail": "id ингредиентов и missing должны быть числами."},
+                status=status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids:
+            return Response({"detail": "Не переданы ингредиенты."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = get_pantry_index().rank(ingredient_ids, max_missing)
+        page = self.paginate_queryset(ranked)
+        recipes = Recipe.objects.for_detail(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        page = [item for item in page if item[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True).data
+        for item, (_, covered, missing) in zip(data, page):
+            item['covered_count'] = covered
+            item['missing_count'] = missing
+        return self.get_paginated_response(data)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, id=None):
         """Добавляет или удаляет рецепт из избранного."""
-        recipe = get_object_or_404(Recipe, id=id)
+        return self.toggle_recipe(request, FavoriteRecipe, id,
+                                  "Рецепт уже в избранном.",
+                                  "Рецепт не найден в избранном.")
 
-        if request.method == 'POST':
-            if FavoriteRecipe.objects.filter(user=request.user,
-                                             recipe=recipe).exists():
-                return Response({"detail": "Рецепт уже в избранном."},
-                                status=status.HTTP_400_BAD_REQUEST)
 
-            FavoriteRecipe.objects.create(user=request.user, recipe=recipe)
-            return Response({
-                "id": recipe.id,
-                "name": recipe.name,
-                "image": recipe.image.url if recipe.image else None,
-                "cooking_time": recipe.cooking_time
-            }, status=status.HTTP_201_CREATED)
-
-        elif request.method == 'DELETE':
-            favorite_item = FavoriteRecipe.objects.filter(user=request.user,
-                                                          recipe=recipe
-                                                          ).first()
-            if not favorite_item:
-                return Response({"detail": "Рецепт не найден в избранном."},
-                                status=status.HTTP_400_BAD_REQUEST)
+def short_link_redirect(request, code):
+    """Перенаправляет с короткой ссылки на страницу рецепта.
 
-            favorite_item.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+    Обычная view Django без DRF: id восстанавливается из кода,
+    а проверка существования обычно обходится без запроса к БД.
+    """
+    recipe_id = shortlinks.decode(code)
+    if recipe_id is None or (settings.SHORT_LINK_CHECK_EXISTS
+                             and not shortlinks.recipe_exists(recipe_id)):
+        raise Http404
+    response = HttpResponseRedirect(f'/recipes/{recipe_id}/')
+    patch_cache_control(response, public=True,
+                        max_age=settings.SHORT_LINK_MAX_AGE)
+    return response
 
 
 @api_view(['PUT', 'DELETE'])
@@ -447,7 +604,7 @@ def avatar_view(request):
 
     elif request.method == 'DELETE':
         if user.avatar:
-            user.avatar.delete(save=False)
+            release(user.avatar.name)
             user.avatar = None
             user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -456,7 +613,7 @@ def avatar_view(request):
                         status=status.HTTP_404_NOT_FOUND)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """Класс для работы с ингредиентами.
 
     Позволяет выполнять GET запросы для получения списка ингредиентов.
@@ -464,11 +621,37 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['^name']
 
+    def list(self, request, *args, **kwargs):
+        """Автодополнение по названию из индекса в памяти процесса.
 
-class UserSubscriptionViewSet(viewsets.GenericViewSet):
+        Строка поиска передается в name (или search), размер выдачи
+        ограничен параметром limit.
+        """
+        query = (request.query_params.get('name')
+                 or request.query_params.get('search', ''))
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.INGREDIENT_SEARCH_LIMIT))
+        except ValueError:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        limit = max(1, min(limit, settings.INGREDIENT_SEARCH_MAX_LIMIT))
+        return Response(get_ingredient_index().search(query, limit))
+
+    def retrieve(self, request, *args, **kwargs):
+        """Возвращает ингредиент из индекса по id."""
+        try:
+            ingredient = get_ingredient_index().get(int(kwargs['pk']))
+        except ValueError:
+            ingredient = None
+        if ingredient is None:
+            return Response({"detail": "Ингредиент не найден."},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(ingredient)
+
+
+class UserSubscriptionViewSet(ReplicaReadMixin,
+                              viewsets.GenericViewSet):
     """Класс для управления подписками пользователей.
 
     Обрабатывает подписки на других пользователей.
@@ -481,46 +664,71 @@ class UserSubscriptionViewSet(viewsets.GenericViewSet):
     def subscriptions(self, request):
         """Возвращает список подписок текущего пользователя."""
         subscriptions = Subscription.objects.filter(
-            user=request.user).select_related('subscribed_to')
+            user=request.user
+        ).select_related('subscribed_to').annotate(
+            recipes_count=Count('subscribed_to__recipe')
+        ).order_by('-id')
         page = self.paginate_queryset(subscriptions)
 
         if page is not None:
-            serializer = UserSubscribedSerializer([sub.subscribed_to for sub in
-                                                  page],
-                                                  many=True,
-                                                  context={'request': request})
-
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(
+                self.serialize_subscriptions(page))
+
+        return Response(self.serialize_subscriptions(subscriptions))
+
+    def serialize_subscriptions(self, subscriptions):
+        """Сериализует авторов, на которых подписан пользователь."""
+        authors = []
+        for subscription in subscriptions:
+            author = subscription.subscribed_to
+            author.recipes_count = subscription.recipes_count
+            author.subscribed = True
+            authors.append(author)
+        return self.serialize_authors(authors)
+
+    def get_recipes_limit(self):
+        """Лимит рецептов автора из параметра recipes_limit."""
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(recipes_limit, 0)
 
-        serializer = UserSubscribedSerializer([sub.subscribed_to for sub in
-                                               subscriptions],
-                                              many=True,
-                                              context={'request': request})
+    def serialize_authors(self, authors):
+        """Сериализует авторов с их последними рецептами.
 
-        return Response(serializer.data)
+        Рецепты всех авторов страницы выбираются одним запросом.
+        """
+        recipes_by_author = defaultdict(list)
+        for recipe in Recipe.objects.filter(
+                author__in=authors
+        ).latest_per_author(self.get_recipes_limit()):
+            recipes_by_author[recipe.author_id].append(recipe)
+
+        context = self.get_serializer_context()
+        context['recipes_by_author'] = recipes_by_author
+        context['image_variant'] = 'small'
+        return UserSubscribedSerializer(authors, many=True,
+                                        context=context).data
 
     @action(detail=True, methods=['post', 'delete'])
     def subscribe(self, request, id=None):
         """Подписка или отписка от пользователя."""
-        user_to_subscribe = get_object_or_404(User, id=id)
-
         if request.method == 'POST':
-            if user_to_subscribe == request.user:
+            if str(id) == str(request.user.id):
                 return Response({
                     "detail": "Нельзя подписаться на самого себя."},
                     status=400)
 
-            Subscription.objects.get_or_create(user=request.user,
-                                               subscribed_to=user_to_subscribe)
-            return Response(UserSubscribedSerializer(user_to_subscribe,
-                                                     context={
-                                                         'request': request}
-                                                     ).data, status=201)
-
-        elif request.method == 'DELETE':
-            subscription = Subscription.objects.filter(
-                user=request.user, subscribed_to=user_to_subscribe).first()
-            if subscription:
-                subscription.delete()
-                return Response(status=204)
-            return Response({"detail": "Не подписан."}, status=400)
+            user_to_subscribe = toggles.subscribe(request.user.id, id)
+            if user_to_subscribe is None:
+                raise Http404
+            return Response(self.serialize_authors([user_to_subscribe])[0],
+                            status=201)
+
+        subscribed = toggles.unsubscribe(request.user.id, id)
+        if subscribed is None:
+            raise Http404
+        if subscribed:
+            return Response(status=204)
+        return Response({"detail": "Не подписан."}, status=400)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Под ASGI по умолчанию подключаются асинхронные view из api.async_views.
+os.environ.setdefault('ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
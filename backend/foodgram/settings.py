@@ -14,6 +14,8 @@ from pathlib import Path
 from datetime import timedelta
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api.apps.ApiConfig',
     'users.apps.UsersConfig',
     'rest_framework',
@@ -45,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +58,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Запросы дольше стольких миллисекунд логируются вместе со списком SQL;
+# пустое значение отключает такой лог
+SLOW_REQUEST_MS = os.getenv('SLOW_REQUEST_MS', '500')
+SLOW_REQUEST_MS = float(SLOW_REQUEST_MS) if SLOW_REQUEST_MS else None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': os.getenv('TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
 
 CSRF_TRUSTED_ORIGINS = ['http://skakunfoodgram.zapto.org', 'https://skakunfoodgram.zapto.org']
 
@@ -83,6 +106,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Асинхронные версии тегов, ингредиентов и переключателей избранного,
+# корзины и подписок (api.async_views). Включается при запуске под ASGI,
+# см. foodgram/asgi.py.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'false').lower() == 'true'
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -97,6 +125,77 @@ DATABASES = {
     }
 }
 
+# Соединения с БД, DB_POOL_MODE:
+# none — новое соединение на каждый запрос;
+# persistent — соединение живет в потоке воркера DB_CONN_MAX_AGE секунд
+# и перед переиспользованием проверяется запросом;
+# pool — пул psycopg_pool на процесс (api.postgresql_pool) с размером
+# от DB_POOL_MIN_SIZE до DB_POOL_MAX_SIZE. Под ASGI поток создается
+# на каждый запрос, поэтому соединения там переиспользует только pool.
+# Всего соединений у сервера — воркеры x соединений на воркер, их сумма
+# не должна превышать max_connections (см. manage.py db_connections).
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'none').lower()
+if DB_POOL_MODE == 'persistent':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    })
+elif DB_POOL_MODE == 'pool':
+    DATABASES['default'].update({
+        'ENGINE': 'api.postgresql_pool',
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                # Секунды: жизнь соединения, простой до закрытия лишних
+                # сверх min_size и ожидание свободного соединения.
+                'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+                'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                'check': os.getenv('DB_POOL_CHECK', 'true').lower() == 'true',
+            },
+        },
+    })
+elif DB_POOL_MODE != 'none':
+    raise ImproperlyConfigured(
+        'DB_POOL_MODE должен быть none, persistent или pool.')
+
+# Реплики для чтения: DB_REPLICA_HOSTS=host[:port],host[:port]. Безопасные
+# запросы к рецептам, тегам, ингредиентам и спискам пользователей читают
+# со случайной реплики (api.routers), кроме пользователей, которые писали
+# в последние REPLICA_STICKY_SECONDS секунд: те читают с primary.
+DB_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DB_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# Кеш. Счетчики поколений, по которым сбрасываются кеши тегов
+# и индекс ингредиентов, должны быть общими для всех воркеров,
+# поэтому в продакшене нужен REDIS_URL; без него кеш живет в памяти процесса.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Кеш анонимной ленты рецептов: время жизни записи и ожидание
+# конкурентных промахов по одному ключу, в секундах
+FEED_CACHE_TIMEOUT = 300
+FEED_CACHE_LOCK_TIMEOUT = 5
+FEED_CACHE_LOCK_POLL = 0.05
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,10 +230,17 @@ USE_TZ = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
 
+# Кеш токенов: размер и время жизни LRU процесса в секундах.
+# С TOKEN_CACHE_SHARED снимки хранятся в общем кеше вместо LRU.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 60))
+TOKEN_CACHE_SHARED = os.getenv('TOKEN_CACHE_SHARED', 'false').lower() == 'true'
+TOKEN_CACHE_SHARED_TTL = int(os.getenv('TOKEN_CACHE_SHARED_TTL', 3600))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=360),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -149,6 +255,51 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Изображения рецептов и аватары хранятся под хешем содержимого
+# (api.storage) и отдаются nginx как immutable
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'content': {
+        'BACKEND': 'api.storage.ContentAddressedStorage',
+    },
+}
+
+# Уменьшенные копии изображений рецептов, строятся в фоновом пуле потоков
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_VARIANTS = {
+    'small': (480, 320),
+    'medium': (960, 640),
+}
+RECIPE_IMAGE_QUALITY = 80
+
+# Индекс подбора рецептов по продуктам: сколько изменений процесс
+# догоняет по журналу в кеше, прежде чем перестроить индекс целиком,
+# и сколько секунд хранятся записи журнала
+PANTRY_MAX_REPLAY = 1000
+PANTRY_CHANGE_LOG_TIMEOUT = 60 * 60
+
+# Короткие ссылки: размер LRU проверенных id рецептов, проверка
+# существования рецепта при переходе и время кеширования редиректа
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 100000))
+SHORT_LINK_CHECK_EXISTS = (
+    os.getenv('SHORT_LINK_CHECK_EXISTS', 'true').lower() == 'true')
+SHORT_LINK_MAX_AGE = 3600
+
+# Размер выдачи автодополнения ингредиентов
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_MAX_LIMIT = 100
+
+# TTF-шрифт с кириллицей для pdf-версии списка покупок
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
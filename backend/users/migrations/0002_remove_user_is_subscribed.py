@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='is_subscribed',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 04:48
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_remove_user_is_subscribed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.content_storage, upload_to='avatars'),
+        ),
+    ]
@@ -8,6 +8,8 @@ from django.core.files.base import ContentFile
 import base64
 from django.utils import timezone
 
+from api.storage import content_storage, release
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     """Модель для пользователей."""
@@ -28,8 +30,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     password = models.CharField(max_length=120, )
     first_name = models.CharField(max_length=120)
     last_name = models.CharField(max_length=120)
-    is_subscribed = models.BooleanField(default=False)
-    avatar = models.ImageField(upload_to='avatars', blank=True, null=True)
+    avatar = models.ImageField(upload_to='avatars', blank=True, null=True,
+                               storage=content_storage)
     REQUIRED_FIELDS = ['email', 'password', 'first_name', 'last_name']
     USERNAME_FIELD = 'username'
     date_joined = models.DateTimeField(default=timezone.now)
@@ -47,4 +49,6 @@ class User(AbstractBaseUser, PermissionsMixin):
             ext = header.split('/')[1]
             file_name = f'avatar_{user}.{ext}'
             image = ContentFile(base64.b64decode(imgstr), name=file_name)
+            old_avatar = self.avatar.name
             self.avatar.save(file_name, image, save=True)
+            release(old_avatar)